@@ -0,0 +1,26 @@
+"""Historical sync in parallel, run with sync.py stopped
+
+    python backfill.py --processes 8
+
+Starts at the db tip and stops SYNC["undo"] blocks below the node tip
+by default, sync.py takes over from there with reorg protection.
+"""
+from server.sync.backfill import backfill
+from server.sync import schema, SYNC
+from server.utils import make_request
+import argparse
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Parallel historical sync")
+    parser.add_argument("--end", type=int, help="last height, node tip - undo depth by default")
+    parser.add_argument("--processes", type=int, help="worker processes, one per cpu by default")
+    parser.add_argument("--shard", type=int, help="blocks per shard")
+    args = parser.parse_args()
+
+    schema.upgrade()
+
+    end = args.end if args.end is not None else (
+        make_request("getblockcount")["result"] - SYNC["undo"]
+    )
+
+    backfill(end, args.processes, args.shard)
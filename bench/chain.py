@@ -0,0 +1,426 @@
+from hashlib import sha256
+import random
+import json
+
+COIN = 100000000
+REWARD = 4 * COIN
+PREMINE = 2100000000 * COIN
+GENESIS_TIME = 1640995200
+BLOCK_TIME = 60
+
+
+def digest(*parts):
+    return sha256(":".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def make_address(index):
+    return "P" + digest("address", index)[:33]
+
+
+def script(kind, address, token=None):
+    result = {
+        "asm": f"OP_DUP OP_HASH160 {digest('script', address)[:40]} OP_EQUALVERIFY OP_CHECKSIG",
+        "hex": "76a914" + digest("script", address)[:40] + "88ac",
+        "type": kind,
+        "reqSigs": 1,
+        "addresses": [address]
+    }
+
+    if token:
+        result["token"] = token
+
+    return result
+
+
+class Chain(object):
+    """Fixture chain served by the fake node
+
+    Blocks and transactions are stored the way the node returns them from
+    getblock / getrawtransaction, minus the fields that depend on the tip
+    (confirmations, nextblockhash) which are filled in when served.
+    """
+
+    def __init__(self, blocks=None, transactions=None, mempool=None,
+                 tokens=None):
+        self.transactions = transactions or {}
+        self.mempool = mempool or []
+        self.blocks = blocks or []
+        self.tokens = tokens or {}
+        self.index()
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as fixture:
+            return cls(**json.load(fixture))
+
+    def save(self, path):
+        with open(path, "w") as fixture:
+            json.dump({
+                "blocks": self.blocks,
+                "transactions": self.transactions,
+                "mempool": self.mempool,
+                "tokens": self.tokens
+            }, fixture)
+
+    def index(self):
+        self.hashes = {block["hash"]: block for block in self.blocks}
+        self.heights = {}
+        self.addresses = {}
+        self.spent = {}
+
+        for block in self.blocks:
+            for txid in block["tx"]:
+                self.heights[txid] = block["height"]
+
+        for block in self.blocks:
+            for txid in block["tx"]:
+                self.index_transaction(self.transactions[txid])
+
+        for txid in self.mempool:
+            self.index_transaction(self.transactions[txid])
+
+    def index_transaction(self, tx):
+        height = self.heights.get(tx["txid"], -1)
+
+        for n, vin in enumerate(tx["vin"]):
+            if "coinbase" in vin:
+                continue
+
+            self.spent[(vin["txid"], vin["vout"])] = {
+                "txid": tx["txid"], "vin": n, "height": height
+            }
+
+            prevout = self.transactions[vin["txid"]]["vout"][vin["vout"]]
+            self.link(prevout["scriptPubKey"], tx["txid"])
+
+        for vout in tx["vout"]:
+            self.link(vout["scriptPubKey"], tx["txid"])
+
+    def link(self, script, txid):
+        for address in script.get("addresses", []):
+            txids = self.addresses.setdefault(address, [])
+
+            if txid not in txids:
+                txids.append(txid)
+
+    @property
+    def height(self):
+        return len(self.blocks) - 1
+
+    def block(self, height, verbosity=1):
+        block = dict(self.blocks[height])
+        block["confirmations"] = self.height - height + 1
+
+        if height < self.height:
+            block["nextblockhash"] = self.blocks[height + 1]["hash"]
+
+        if verbosity == 2:
+            block["tx"] = [self.transaction(txid) for txid in block["tx"]]
+
+        return block
+
+    def transaction(self, txid):
+        tx = dict(self.transactions[txid])
+
+        if txid in self.heights:
+            block = self.blocks[self.heights[txid]]
+            tx["blockhash"] = block["hash"]
+            tx["blocktime"] = block["time"]
+            tx["time"] = block["time"]
+            tx["confirmations"] = self.height - block["height"] + 1
+
+        return tx
+
+    def outputs(self, address, confirmed=True):
+        for txid in self.addresses.get(address, []):
+            if confirmed != (txid in self.heights):
+                continue
+
+            for vout in self.transactions[txid]["vout"]:
+                if address in vout["scriptPubKey"].get("addresses", []):
+                    yield txid, vout
+
+    def reorg(self, depth, seed="reorg", stake=0):
+        """Replace the top blocks with a competing branch of equal length"""
+        replaced = self.blocks[-depth:]
+        self.blocks = self.blocks[:-depth]
+
+        for block in replaced:
+            for txid in block["tx"]:
+                self.transactions.pop(txid)
+
+        # Mempool entries spending the orphaned branch are gone as well
+        self.mempool = [
+            txid for txid in self.mempool
+            if all(
+                "coinbase" in vin or vin["txid"] in self.transactions
+                for vin in self.transactions[txid]["vin"]
+            )
+        ]
+
+        generator = Generator(seed=seed, chain=self, stake=stake)
+
+        for _ in replaced:
+            generator.block(txs=1)
+
+        self.index()
+
+
+class Pool(object):
+    """Unspent outputs with O(1) random pick and removal"""
+
+    def __init__(self):
+        self.positions = {}
+        self.items = []
+
+    def __len__(self):
+        return len(self.items)
+
+    def add(self, key, value):
+        self.positions[key] = len(self.items)
+        self.items.append((key, value))
+
+    def remove(self, key):
+        if key not in self.positions:
+            return
+
+        position = self.positions.pop(key)
+        last = self.items.pop()
+
+        if position < len(self.items):
+            self.items[position] = last
+            self.positions[last[0]] = position
+
+    def choice(self, generator):
+        return generator.choice(self.items)
+
+
+class Generator(object):
+    """Deterministic synthetic chain for offline runs"""
+
+    def __init__(self, seed=0, addresses=100, chain=None, stake=0):
+        self.random = random.Random(seed)
+        self.stake = stake
+        self.chain = chain or Chain()
+        self.addresses = [make_address(index) for index in range(addresses)]
+        self.tokens = Pool()
+        self.plain = Pool()
+        self.seed = seed
+
+        for block in self.chain.blocks:
+            for txid in block["tx"]:
+                self.track(self.chain.transactions[txid])
+
+    def track(self, tx):
+        for vin in tx["vin"]:
+            if "coinbase" not in vin:
+                self.plain.remove((vin["txid"], vin["vout"]))
+                self.tokens.remove((vin["txid"], vin["vout"]))
+
+        for vout in tx["vout"]:
+            if "addresses" not in vout["scriptPubKey"]:
+                continue
+
+            token = vout["scriptPubKey"].get("token")
+            address = vout["scriptPubKey"]["addresses"][0]
+            key = (tx["txid"], vout["n"])
+
+            if token:
+                self.tokens.add(key, (address, token["name"], token["satoshis"]))
+
+            elif vout["valueSat"] > COIN:
+                self.plain.add(key, (address, vout["valueSat"]))
+
+    def output(self, n, address, value, currency="PLB", token_amount=0,
+               kind="pubkeyhash"):
+        token = None
+
+        if currency != "PLB":
+            token = {
+                "name": currency,
+                "amount": token_amount / COIN,
+                "satoshis": token_amount,
+                "timelock": 0
+            }
+
+        return {
+            "value": value / COIN,
+            "valueSat": value,
+            "n": n,
+            "scriptPubKey": script(kind, address, token)
+        }
+
+    @staticmethod
+    def empty(n):
+        # Proof-of-stake blocks mark the coinbase and coinstake this way
+        return {
+            "value": 0.0,
+            "valueSat": 0,
+            "n": n,
+            "scriptPubKey": {"asm": "", "hex": "", "type": "nonstandard"}
+        }
+
+    def transaction(self, height, index, vin, vout):
+        txid = digest("tx", self.seed, height, index, len(self.chain.transactions))
+        size = 60 + len(vin) * 148 + len(vout) * 34
+
+        tx = {
+            "txid": txid,
+            "hash": txid,
+            "version": 2,
+            "size": size,
+            "vsize": size,
+            "locktime": 0,
+            "timestamp": GENESIS_TIME + height * BLOCK_TIME,
+            "vin": vin,
+            "vout": vout
+        }
+
+        self.chain.transactions[txid] = tx
+        self.track(tx)
+
+        return tx
+
+    def coinbase(self, height):
+        miner = self.random.choice(self.addresses)
+        vin = [{"coinbase": digest("coinbase", height)[:16], "sequence": 4294967295}]
+        vout = [self.output(0, miner, REWARD if height else 0)]
+
+        # Block 1 carries the premine, spread out so there is always
+        # something to spend
+        if height == 1:
+            share = PREMINE // len(self.addresses)
+            vout += [
+                self.output(n + 1, address, share)
+                for n, address in enumerate(self.addresses)
+            ]
+
+        return self.transaction(height, 0, vin, vout)
+
+    def coinstake(self, height):
+        """Empty coinbase plus a coinstake paying the staked output back
+        with the reward on top. The inputs carry no values, like a node
+        without the spent index, so sync has to resolve them itself.
+        """
+        vin = [{"coinbase": digest("coinbase", height)[:16], "sequence": 4294967295}]
+        coinbase = self.transaction(height, 0, vin, [self.empty(0)])
+
+        (txid, n), (address, value) = self.plain.choice(self.random)
+        vin = [{"txid": txid, "vout": n, "sequence": 4294967295}]
+        vout = [self.empty(0), self.output(1, address, value + REWARD)]
+
+        return [coinbase, self.transaction(height, 1, vin, vout)]
+
+    def spend(self, height, index):
+        if not self.plain:
+            return None
+
+        (txid, n), (address, value) = self.plain.choice(self.random)
+        vin = [{"txid": txid, "vout": n, "sequence": 4294967294}]
+        token = None
+
+        if self.tokens and self.random.random() < 0.2:
+            (token_txid, token_n), token = self.tokens.choice(self.random)
+            vin.append({"txid": token_txid, "vout": token_n, "sequence": 4294967294})
+
+        value = value - COIN // 1000
+        payment = self.random.randint(1, value - 1)
+        vout = [
+            self.output(0, self.random.choice(self.addresses), payment),
+            self.output(1, address, value - payment)
+        ]
+
+        if token:
+            vout.append(self.output(
+                2, self.random.choice(self.addresses), 0,
+                token[1], token[2], "transfer_token"
+            ))
+
+        return self.transaction(height, index, vin, vout)
+
+    def issue(self, height, index, name, amount):
+        (txid, n), (address, value) = self.plain.choice(self.random)
+
+        vin = [{"txid": txid, "vout": n, "sequence": 4294967294}]
+        vout = [
+            self.output(0, address, value - COIN // 1000),
+            self.output(1, address, 0, name, amount * COIN, "new_token")
+        ]
+
+        tx = self.transaction(height, index, vin, vout)
+
+        self.chain.tokens[name] = {
+            "name": name,
+            "amount": amount,
+            "units": 8,
+            "reissuable": 1,
+            "has_ipfs": 0,
+            "block_height": height,
+            "blockhash": None
+        }
+
+        return tx
+
+    def block(self, txs=10, tokens=None, include=None, stake=None):
+        height = len(self.chain.blocks)
+        previous = self.chain.blocks[-1] if self.chain.blocks else None
+
+        # The random draw is skipped without stake so existing chains
+        # generate exactly as before
+        if stake is None:
+            stake = height > 1 and self.stake > 0 and self.random.random() < self.stake
+
+        transactions = (
+            self.coinstake(height) if stake else [self.coinbase(height)]
+        ) + (include or [])
+
+        for name in tokens or []:
+            transactions.append(self.issue(height, len(transactions), name, 1000))
+
+        for _ in range(txs if height else 0):
+            if (tx := self.spend(height, len(transactions))):
+                transactions.append(tx)
+
+        bhash = digest("block", self.seed, height, previous["hash"] if previous else "")
+        block = {
+            "hash": bhash,
+            "height": height,
+            "version": 536870912,
+            "merkleroot": digest("merkle", bhash),
+            "time": GENESIS_TIME + height * BLOCK_TIME,
+            "mediantime": GENESIS_TIME + height * BLOCK_TIME,
+            "nonce": self.random.randint(0, 2 ** 32 - 1),
+            "bits": "1e0fffff",
+            "difficulty": 0.000244,
+            "chainwork": format(height + 1, "064x"),
+            "flags": "proof-of-stake" if stake else "proof-of-work",
+            "size": sum(tx["size"] for tx in transactions) + 80,
+            "weight": (sum(tx["size"] for tx in transactions) + 80) * 4,
+            "tx": [tx["txid"] for tx in transactions]
+        }
+
+        if previous:
+            block["previousblockhash"] = previous["hash"]
+
+        if stake:
+            block["signature"] = digest("signature", bhash) * 2
+
+        for name in tokens or []:
+            self.chain.tokens[name]["blockhash"] = bhash
+
+        self.chain.blocks.append(block)
+
+        return block
+
+    def generate(self, blocks, txs=10, mempool=0, tokens=3):
+        for height in range(blocks):
+            names = [f"TOKEN{height}"] if 1 <= height <= tokens else []
+            self.block(txs, names)
+
+        for index in range(mempool):
+            if (tx := self.spend(len(self.chain.blocks), 10000 + index)):
+                self.chain.mempool.append(tx["txid"])
+
+        self.chain.index()
+
+        return self.chain
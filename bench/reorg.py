@@ -0,0 +1,66 @@
+"""Reorg rollback benchmark
+
+Syncs a synthetic chain from the fake node into the database configured
+in config.py, then repeatedly replaces the top of the chain with a
+competing branch and times rolling it back and syncing the new branch:
+
+    python -m bench.reorg --blocks 300 --txs 50 --depth 1 6 50
+
+The database is written to, point config.db at an empty scratch one.
+"""
+from .fakenode import FakeNode, serve, endpoint
+from .chain import Generator
+import argparse
+import config
+import time
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reorg rollback benchmark")
+    parser.add_argument("--blocks", type=int, default=300, help="synthetic chain length")
+    parser.add_argument("--txs", type=int, default=50, help="transactions per block")
+    parser.add_argument("--depth", type=int, nargs="+", default=[1, 6, 50])
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stake", type=float, default=0.25, help="share of proof-of-stake blocks")
+    args = parser.parse_args()
+
+    chain = Generator(args.seed, stake=args.stake).generate(args.blocks, args.txs)
+    node = FakeNode(chain)
+    server = serve(node)
+
+    # The node client is built on import, point it at the fake node first
+    config.endpoint = endpoint(server)
+
+    from server.services import BlockService
+    from server.sync import sync_blocks, rollback
+    from server.node import client
+    from pony import orm
+
+    started = time.time()
+    sync_blocks()
+    print(f"Initial sync of {args.blocks} blocks: {time.time() - started:.2f}s")
+
+    for depth in args.depth:
+        with node.lock:
+            chain.reorg(depth, seed=f"reorg-{depth}", stake=args.stake)
+
+        with client.pinned(), orm.db_session:
+            started = time.time()
+            rollback(BlockService.latest_block())
+            orm.commit()
+            rolled = time.time() - started
+
+        started = time.time()
+        sync_blocks()
+        synced = time.time() - started
+
+        print(
+            f"depth={depth} rollback={rolled:.3f}s ({rolled / depth * 1000:.1f}ms/block) "
+            f"resync={synced:.3f}s"
+        )
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
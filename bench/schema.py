@@ -0,0 +1,55 @@
+"""Deferred index check
+
+Recreates every table in the database configured in config.py from the
+models, then drops and rebuilds the indexes initial block download
+defers and checks each one went away and came back:
+
+    python -m bench.schema
+
+The database is wiped, point config.db at an empty scratch one.
+"""
+from server.sync.schema import DEFERRED_INDEXES, has_index
+from server.sync.schema import defer_indexes, restore_indexes
+from server.models import db
+from pony import orm
+import sys
+
+
+def present(cursor):
+    return {
+        name: has_index(cursor, table, name)
+        for table, name, _ in DEFERRED_INDEXES
+    }
+
+
+@orm.db_session
+def check():
+    cursor = db.get_connection().cursor()
+    failed = False
+
+    # The models leave these to restore_indexes, start from the full set
+    restore_indexes()
+    defer_indexes()
+    deferred = present(cursor)
+
+    restore_indexes()
+    restored = present(cursor)
+
+    for table, name, _ in DEFERRED_INDEXES:
+        ok = not deferred[name] and restored[name]
+        failed = failed or not ok
+
+        print(f"{'ok' if ok else 'FAILED':6} {table}.{name}: dropped={not deferred[name]} rebuilt={restored[name]}")
+
+    return failed
+
+
+def main():
+    db.drop_all_tables(with_all_data=True)
+    db.create_tables()
+
+    sys.exit(1 if check() else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Block sync throughput benchmark
+
+Serves a synthetic, fixture or recorded chain from the fake node and runs
+the block sync over it into the database configured in config.py, then
+reports throughput and where the time went:
+
+    python -m bench.throughput --generate 500 --txs 50 --reset --output base.json
+    python -m bench.throughput --generate 500 --txs 50 --reset --compare base.json
+
+--reset drops and recreates every table, point config.db at a scratch
+database. --compare exits with status 1 when throughput dropped or peak
+memory grew by more than --threshold.
+"""
+from .fakenode import FakeNode, serve, endpoint
+from .chain import Chain, Generator
+import threading
+import argparse
+import resource
+import config
+import time
+import json
+
+# Higher is better for these, lower for the rest
+THROUGHPUT = ["blocks_per_s", "tx_per_s", "inputs_per_s", "rows_per_s"]
+FOOTPRINT = ["peak_rss_mb"]
+
+
+class DBTimer(object):
+    """Wall time spent in MySQL calls made from the sync thread"""
+
+    def __init__(self):
+        self.thread = threading.get_ident()
+        self.depth = 0
+        self.time = 0
+
+    def wrap(self, owner, name):
+        original = getattr(owner, name)
+        timer = self
+
+        def timed(*args, **kwargs):
+            # executemany calls execute, only count the outer call
+            if threading.get_ident() != timer.thread or timer.depth:
+                return original(*args, **kwargs)
+
+            timer.depth += 1
+            started = time.perf_counter()
+
+            try:
+                return original(*args, **kwargs)
+
+            finally:
+                timer.time += time.perf_counter() - started
+                timer.depth -= 1
+
+        setattr(owner, name, timed)
+
+    def install(self):
+        import pymysql
+
+        self.wrap(pymysql.cursors.Cursor, "execute")
+        self.wrap(pymysql.cursors.Cursor, "executemany")
+        self.wrap(pymysql.connections.Connection, "commit")
+
+
+def run(args):
+    chain = None
+    recordings = {}
+
+    if args.fixture:
+        chain = Chain.load(args.fixture)
+
+    elif args.generate or not args.replay:
+        chain = Generator(args.seed, stake=args.stake).generate(args.generate or 300, args.txs)
+
+    if args.replay:
+        with open(args.replay) as replay:
+            recordings = json.load(replay)
+
+    server = serve(FakeNode(chain, recordings, latency=args.latency))
+
+    # Sync settings and the node client are read on import
+    config.endpoint = endpoint(server)
+    config.sync = dict(getattr(config, "sync", {}), **{
+        key: value for key, value in [
+            ("workers", args.workers), ("prefetch", args.prefetch),
+            ("ibd", args.ibd)
+        ] if value is not None
+    })
+
+    from server.sync import sync_blocks, stats
+    from server.node import Metrics, metrics
+    from server.models import db
+
+    if args.reset:
+        db.drop_all_tables(with_all_data=True)
+        db.create_tables()
+
+    timer = DBTimer()
+    timer.install()
+
+    rpc_before = metrics.snapshot()
+    before = stats.snapshot()
+    started = time.time()
+    previous = None
+
+    # Passes stop early on fetch errors, run until the tip stops moving
+    while (tip := sync_blocks()) != previous:
+        previous = tip
+
+    wall = time.time() - started
+    done = stats.diff(before, stats.snapshot())
+    rpc = Metrics.diff(rpc_before, metrics.snapshot())
+    server.shutdown()
+
+    return {
+        "parameters": vars(args),
+        "blocks": done["blocks"],
+        "transactions": done["transactions"],
+        "inputs": done["inputs"],
+        "rows": done["rows"],
+        "wall_s": round(wall, 3),
+        "blocks_per_s": round(done["blocks"] / wall, 2),
+        "tx_per_s": round(done["transactions"] / wall, 2),
+        "inputs_per_s": round(done["inputs"] / wall, 2),
+        "rows_per_s": round(done["rows"] / wall, 2),
+        "rpc_s": round(sum(entry["time"] for entry in rpc.values()), 3),
+        "rpc_calls": sum(entry["calls"] for entry in rpc.values()),
+        "fetch_wait_s": round(done["fetch_wait"], 3),
+        "db_s": round(timer.time, 3),
+        "python_s": round(wall - timer.time - done["fetch_wait"], 3),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+
+def compare(result, baseline, threshold):
+    regressions = []
+
+    for key in THROUGHPUT + FOOTPRINT:
+        if not baseline.get(key):
+            continue
+
+        change = (result[key] - baseline[key]) / baseline[key]
+        worse = change < -threshold if key in THROUGHPUT else change > threshold
+
+        print(f"{key:>14} {baseline[key]:>12} -> {result[key]:<12} {change:+.1%}{'  REGRESSION' if worse else ''}")
+
+        if worse:
+            regressions.append(key)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Block sync throughput benchmark")
+    parser.add_argument("--fixture", help="chain fixture to sync")
+    parser.add_argument("--generate", type=int, help="synthetic chain length, 300 by default")
+    parser.add_argument("--txs", type=int, default=50, help="transactions per synthetic block")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stake", type=float, default=0.25, help="share of proof-of-stake synthetic blocks")
+    parser.add_argument("--replay", help="recorded node responses to serve")
+    parser.add_argument("--latency", type=float, default=0, help="added node latency, ms")
+    parser.add_argument("--workers", type=int, help="override sync[\"workers\"]")
+    parser.add_argument("--prefetch", type=int, help="override sync[\"prefetch\"]")
+    parser.add_argument("--ibd", type=int, help="override sync[\"ibd\"]")
+    parser.add_argument("--reset", action="store_true", help="drop and recreate all tables first")
+    parser.add_argument("--output", help="write the report to this file")
+    parser.add_argument("--compare", help="report to compare against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="allowed relative change")
+    args = parser.parse_args()
+
+    result = run(args)
+    print(json.dumps(result, indent=2))
+
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(result, output, indent=2)
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            if compare(result, json.load(baseline), args.threshold):
+                raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -12,6 +12,7 @@ cache = Cache(config={"CACHE_TYPE": "simple"})
 cache.init_app(app)
 CORS(app)
 
+from .internal import internal
 from .esplora import esplora
 from .wallet import wallet
 from .rest import rest
@@ -21,6 +22,7 @@ app.register_blueprint(esplora)
 app.register_blueprint(wallet)
 app.register_blueprint(rest)
 app.register_blueprint(db)
+app.register_blueprint(internal)
 
 @app.route("/")
 def frontend():
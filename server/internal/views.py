@@ -0,0 +1,49 @@
+from flask import Blueprint, Response, request, abort
+from ..services import BlockService
+from ..node import client, metrics
+from datetime import datetime
+from pony import orm
+from .. import utils
+import config
+
+internal = Blueprint("internal", __name__, url_prefix="/internal/")
+
+
+@internal.before_request
+def restrict():
+    if request.remote_addr not in getattr(config, "internal", ["127.0.0.1"]):
+        abort(404)
+
+
+@internal.route("/metrics", methods=["GET"])
+def prometheus():
+    return Response(metrics.prometheus(), mimetype="text/plain")
+
+
+@internal.route("/rpc", methods=["GET"])
+def rpc():
+    return utils.response(metrics.snapshot())
+
+
+@internal.route("/nodes", methods=["GET"])
+def nodes():
+    return utils.response(client.status())
+
+
+@internal.route("/sync", methods=["GET"])
+@orm.db_session
+def sync():
+    # What the API serves compared to the node, the sync process has
+    # its own /status with the details
+    latest = BlockService.latest_block()
+    # Still answers with the db side when the node is down
+    data = utils.make_request("getblockcount")
+    node_height = data["result"] if data["error"] is None else None
+    db_height = latest.height if latest else None
+
+    return utils.response(error=data["error"], result={
+        "db_height": db_height,
+        "node_height": node_height,
+        "lag": node_height - db_height if None not in [node_height, db_height] else None,
+        "last_block_age": int((datetime.now() - latest.created).total_seconds()) if latest else None
+    })
@@ -90,8 +90,12 @@ class Address():
     def check(cls, addresses: list):
         addresses = list(set(addresses))
         result = []
-        for address in addresses:
-            data = utils.make_request("getaddresstxids", [address, True])
+
+        batch = utils.make_batch([
+            ("getaddresstxids", [address, True]) for address in addresses
+        ])
+
+        for address, data in zip(addresses, batch):
             if data["error"] is None and "result" in data:
                 if len(data["result"]) > 0:
                     result.append(address)
@@ -76,19 +76,34 @@ class Block():
 
     @classmethod
     def range(cls, height: int, offset: int):
+        heights = list(range(height - (offset - 1), height + 1))
+        calls = []
         result = []
-        for block in range(height - (offset - 1), height + 1):
-            data = utils.make_request("getblockhash", [block])
-            nethash = utils.make_request("getnetworkhashps", [120, block])
 
-            if data["error"] is None and nethash["error"] is None:
-                txid = data["result"]
-                data.pop("result")
-                data["result"] = utils.make_request("getblock", [txid])["result"]
-                data["result"]["txcount"] = len(data["result"]["tx"])
-                data["result"]["nethash"] = int(nethash["result"])
+        for block in heights:
+            calls.append(("getblockhash", [block]))
+            calls.append(("getnetworkhashps", [120, block]))
 
-                result.append(data["result"])
+        data = utils.make_batch(calls)
+        hashes = data[0::2]
+        nethashes = data[1::2]
+
+        found = [
+            (hashes[index]["result"], nethashes[index]["result"])
+            for index in range(len(heights))
+            if hashes[index]["error"] is None and nethashes[index]["error"] is None
+        ]
+
+        blocks = utils.make_batch([("getblock", [bhash]) for bhash, _ in found])
+
+        for index, (bhash, nethash) in enumerate(found):
+            block = blocks[index]
+
+            if block["error"] is None:
+                block["result"]["txcount"] = len(block["result"]["tx"])
+                block["result"]["nethash"] = int(nethash)
+
+                result.append(block["result"])
 
         return result[::-1]
 
@@ -102,20 +117,30 @@ class Block():
         data = utils.make_request("getblockchaininfo")
         height = data["result"]["blocks"]
         offset = 1440
+        heights = list(range(height - (offset - 1), height + 1))
         result = []
 
-        for chunk in chunks(range(height - (offset - 1), height + 1), 24):
-            height = chunk[0]
+        hashes = utils.make_batch([("getblockhash", [block]) for block in heights])
+        found = [
+            (heights[index], item["result"])
+            for index, item in enumerate(hashes)
+            if item["error"] is None
+        ]
+
+        blocks = utils.make_batch([("getblock", [bhash]) for _, bhash in found])
+        txcount = {}
+
+        for index, (block, _) in enumerate(found):
+            if blocks[index]["error"] is None:
+                txcount[block] = len(blocks[index]["result"]["tx"])
+
+        for chunk in chunks(heights, 24):
             total = 0
 
             for block in chunk:
-                data = utils.make_request("getblockhash", [block])
-
-                if data["error"] is None:
-                    tx_data = utils.make_request("getblock", [data["result"]])["result"]
-                    total += len(tx_data["tx"])
+                total += txcount.get(block, 0)
 
-            result.append([height, total])
+            result.append([chunk[0], total])
 
         return result
 
@@ -19,36 +19,56 @@ class Transaction():
         if data["error"] is None:
             if full:
                 data["result"]["height"] = -1
+                calls = []
 
                 if "blockhash" in data["result"]:
-                    block = utils.make_request("getblock", [data["result"]["blockhash"]])["result"]
+                    calls.append(("getblock", [data["result"]["blockhash"]]))
+
+                prevouts = []
+                for vin in data["result"]["vin"]:
+                    if "txid" in vin and vin["txid"] not in prevouts:
+                        prevouts.append(vin["txid"])
+
+                calls += [("getrawtransaction", [txid, True]) for txid in prevouts]
+                batch = utils.make_batch(calls)
+
+                if "blockhash" in data["result"]:
+                    block = batch.pop(0)["result"]
                     data["result"]["height"] = block["height"]
 
+                prevouts = dict(zip(prevouts, batch))
+
                 if data["result"]["height"] != 0:
                     for index, vin in enumerate(data["result"]["vin"]):
                         if "txid" in vin:
-                            vin_data = utils.make_request("getrawtransaction", [vin["txid"], True])
+                            vin_data = prevouts[vin["txid"]]
                             if vin_data["error"] is None:
                                 data["result"]["vin"][index]["scriptPubKey"] = vin_data["result"]["vout"][vin["vout"]]["scriptPubKey"]
                                 data["result"]["vin"][index]["value"] = utils.satoshis(vin_data["result"]["vout"][vin["vout"]]["value"])
 
-            amount = 0
-            for index, vout in enumerate(data["result"]["vout"]):
-                data["result"]["vout"][index]["value"] = utils.satoshis(vout["value"])
-                amount += vout["value"]
+            cls.prepare(data["result"])
 
-                if vout["scriptPubKey"]["type"] == "cltv":
-                    key = vout["scriptPubKey"]["asm"].split(" ")[0]
-                    timelock = 0
+        return data
 
-                    if key.isdigit():
-                        timelock = int(key)
+    @classmethod
+    def prepare(cls, result):
+        amount = 0
+        for index, vout in enumerate(result["vout"]):
+            result["vout"][index]["value"] = utils.satoshis(vout["value"])
+            amount += vout["value"]
 
-                    data["result"]["vout"][index]["scriptPubKey"]["timelock"] = timelock
+            if vout["scriptPubKey"]["type"] == "cltv":
+                key = vout["scriptPubKey"]["asm"].split(" ")[0]
+                timelock = 0
 
-            data["result"]["amount"] = amount
+                if key.isdigit():
+                    timelock = int(key)
 
-        return data
+                result["vout"][index]["scriptPubKey"]["timelock"] = timelock
+
+        result["amount"] = amount
+
+        return result
 
     @classmethod
     @cache.memoize(timeout=config.cache)
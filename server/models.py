@@ -4,6 +4,7 @@ from email.policy import default
 from pony import orm
 from . import utils
 import config
+import os
 
 # db = orm.Database(
 #     provider="mysql", host=config.db["host"],
@@ -20,7 +21,7 @@ class Token(db.Entity):
 
     amount = orm.Required(Decimal, precision=20, scale=8)
     ipfs = orm.Optional(str, nullable=True)
-    name = orm.Required(str, index=True)
+    name = orm.Required(str, unique=True)
     reissuable = orm.Required(bool)
     category = orm.Required(str)
     height = orm.Required(int)
@@ -137,9 +138,16 @@ class Transaction(db.Entity):
         inputs = sorted(inputs, key=lambda d: d["id"])
         inputs = [{key: val for key, val in sub.items() if key != "id"} for sub in inputs]
 
+        # Spending txids in one query instead of loading vin per output
+        spent = [vout.spent_by for vout in self.outputs if vout.spent]
+        spenders = dict(orm.select(
+            (transaction.id, transaction.txid) for transaction in Transaction
+            if transaction.id in spent
+        )) if spent else {}
+
         for vout in self.outputs:
             outputs.append({
-                "vin": vout.vin.transaction.txid if vout.vin else None,
+                "vin": spenders.get(vout.spent_by),
                 "address": vout.address.address,
                 "currency": vout.currency,
                 "timelock": vout.timelock,
@@ -172,7 +180,7 @@ class Transaction(db.Entity):
 class Address(db.Entity):
     _table_ = "chain_addresses"
 
-    address = orm.Required(str, index=True)
+    address = orm.Required(str, unique=True)
     outputs = orm.Set("Output")
 
     transactions = orm.Set(
@@ -189,7 +197,7 @@ class Balance(db.Entity):
     address = orm.Required("Address")
     currency = orm.Required(str)
 
-    orm.composite_index(address, currency)
+    orm.composite_key(address, currency)
 
 class Input(db.Entity):
     _table_ = "chain_inputs"
@@ -211,7 +219,9 @@ class Output(db.Entity):
     _table_ = "chain_outputs"
 
     amount = orm.Required(Decimal, precision=20, scale=8)
-    currency = orm.Required(str, default="PLB", index=True)
+    currency = orm.Required(str, default="PLB")
+    spent_height = orm.Optional(int, size=64, nullable=True)
+    spent_by = orm.Optional(int, size=64, nullable=True)
     timelock = orm.Required(int, default=0)
     amount_raw = orm.Required(int, size=64)
     address = orm.Required("Address")
@@ -223,11 +233,15 @@ class Output(db.Entity):
 
     vin = orm.Optional("Input", cascade_delete=True)
     transaction = orm.Required("Transaction")
-    address = orm.Optional("Address")
+
+    # Its own index backs the foreign key. The currency and unspent
+    # lookup indexes are not declared here, sync/schema.py owns them so
+    # that mapping the models never rebuilds them mid download.
+    address = orm.Optional("Address", index=True)
 
     @property
     def spent(self):
-        return self.vin is not None
+        return self.spent_by is not None
 
     def before_delete(self):
         balance = Balance.get(
@@ -238,12 +252,72 @@ class Output(db.Entity):
 
     orm.composite_index(transaction, n)
 
+class BlockUndo(db.Entity):
+    _table_ = "chain_block_undo"
+
+    blockhash = orm.Required(str, unique=True)
+    height = orm.Required(int, index=True)
+    data = orm.Required(orm.Json)
+
+class SyncState(db.Entity):
+    _table_ = "chain_sync_state"
+
+    name = orm.Required(str, unique=True)
+    blockhash = orm.Required(str)
+    position = orm.Required(int)
+    updated = orm.Required(datetime)
+    height = orm.Required(int)
+    mode = orm.Required(str)
+
 class TransactionIndex(db.Entity):
     _table_ = "chain_transaction_index"
 
-    currency = orm.Required(str, default="PLB", index=True)
+    currency = orm.Required(str, default="PLB")
     amount = orm.Required(Decimal, precision=20, scale=8)
     transaction = orm.Required("Transaction")
     created = orm.Required(datetime)
 
-db.generate_mapping(create_tables=True)
+# Columns added to tables that already exist. Pony only creates missing
+# tables and refuses to map ones without every column, so they are added
+# (and filled from the existing rows) before mapping.
+COLUMNS = [
+    (
+        "chain_outputs", "spent_by", "BIGINT NULL",
+        "UPDATE chain_outputs o JOIN chain_inputs i ON i.vout = o.id "
+        "SET o.spent_by = i.transaction"
+    ),
+    (
+        "chain_outputs", "spent_height", "BIGINT NULL",
+        "UPDATE chain_outputs o JOIN chain_inputs i ON i.vout = o.id "
+        "JOIN chain_transactions t ON t.id = i.transaction "
+        "SET o.spent_height = t.height"
+    )
+]
+
+@orm.db_session
+def add_columns():
+    cursor = db.get_connection().cursor()
+
+    for table, name, definition, fill in COLUMNS:
+        cursor.execute(
+            "SELECT COUNT(*), SUM(column_name = %s) FROM information_schema.columns "
+            "WHERE table_schema = DATABASE() AND table_name = %s",
+            [name, table]
+        )
+
+        existing, found = cursor.fetchone()
+
+        if existing and not found:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+            cursor.execute(fill)
+
+    orm.commit()
+
+# Worker processes (see sync/backfill.py) map onto tables the parent
+# already set up and leave the schema alone
+if os.environ.get("PLB_CREATE_TABLES", "1") == "1":
+    add_columns()
+    db.generate_mapping(create_tables=True)
+
+else:
+    db.generate_mapping(create_tables=False, check_tables=False)
@@ -0,0 +1,11 @@
+from .client import NodeClient, NodeError
+from .cache import ResponseCache
+from .metrics import Metrics
+import config
+
+metrics = Metrics()
+cache = ResponseCache(**getattr(config, "rpc_cache", {}))
+client = NodeClient(
+    config.endpoint, config.rid, cache=cache, metrics=metrics,
+    **getattr(config, "rpc", {})
+)
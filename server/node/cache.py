@@ -0,0 +1,287 @@
+from collections import OrderedDict
+import threading
+import sqlite3
+import time
+import json
+
+# Responses of these methods never change once the block they belong to
+# is buried deep enough. Only the confirmations counter moves, so it is
+# stripped on store and recomputed from the known tip on every hit.
+IMMUTABLE = ["getblock", "getblockheader", "getrawtransaction"]
+
+# How long a known tip height is trusted before it is refreshed
+TIP_TTL = 5
+
+# Block hashes are remembered for this many heights below the tip so
+# that a changed getblockhash answer can be detected as a reorg
+HASH_WINDOW = 1000
+
+
+class MemoryCache(object):
+    def __init__(self, size):
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.size = size
+        self.used = 0
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.entries:
+                return None
+
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, height, value):
+        if len(value) > self.size:
+            return
+
+        with self.lock:
+            if key in self.entries:
+                self.used -= len(self.entries.pop(key)[1])
+
+            self.entries[key] = (height, value)
+            self.used += len(value)
+
+            while self.used > self.size:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.used -= len(evicted)
+
+    def invalidate(self, height):
+        with self.lock:
+            for key in [k for k, v in self.entries.items() if v[0] >= height]:
+                self.used -= len(self.entries.pop(key)[1])
+
+
+class DiskCache(object):
+    """sqlite tier, bounded to size bytes of values by LRU eviction"""
+
+    def __init__(self, path, size):
+        self.lock = threading.Lock()
+        self.size = size
+        self.db = sqlite3.connect(
+            path, check_same_thread=False, isolation_level=None
+        )
+
+        self.db.execute("PRAGMA journal_mode=WAL")
+
+        # Files from before the size bound have no access times, start over
+        columns = [row[1] for row in self.db.execute("PRAGMA table_info(rpc_cache)")]
+
+        if columns and "used" not in columns:
+            self.db.execute("DROP TABLE rpc_cache")
+
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS rpc_cache ("
+            "key TEXT PRIMARY KEY, height INTEGER NOT NULL, value TEXT NOT NULL, "
+            "used REAL NOT NULL)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS rpc_cache_height ON rpc_cache (height)"
+        )
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS rpc_cache_used ON rpc_cache (used)"
+        )
+
+        self.stored = self.db.execute(
+            "SELECT COALESCE(SUM(LENGTH(value)), 0) FROM rpc_cache"
+        ).fetchone()[0]
+
+    def get(self, key):
+        with self.lock:
+            entry = self.db.execute(
+                "SELECT height, value FROM rpc_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+            if entry:
+                self.db.execute(
+                    "UPDATE rpc_cache SET used = ? WHERE key = ?",
+                    (time.time(), key)
+                )
+
+            return entry
+
+    def put(self, key, height, value):
+        if len(value) > self.size:
+            return
+
+        with self.lock:
+            previous = self.db.execute(
+                "SELECT LENGTH(value) FROM rpc_cache WHERE key = ?", (key,)
+            ).fetchone()
+
+            self.db.execute(
+                "INSERT OR REPLACE INTO rpc_cache VALUES (?, ?, ?, ?)",
+                (key, height, value, time.time())
+            )
+
+            self.stored += len(value) - (previous[0] if previous else 0)
+
+            if self.stored > self.size:
+                self.evict()
+
+    def evict(self):
+        # Down to 90% in one go so eviction doesn't run on every put
+        while self.stored > self.size * 0.9:
+            oldest = self.db.execute(
+                "SELECT key, LENGTH(value) FROM rpc_cache ORDER BY used LIMIT 1000"
+            ).fetchall()
+
+            if not oldest:
+                self.stored = 0
+                return
+
+            for key, length in oldest:
+                self.db.execute("DELETE FROM rpc_cache WHERE key = ?", (key,))
+                self.stored -= length
+
+                if self.stored <= self.size * 0.9:
+                    return
+
+    def invalidate(self, height):
+        with self.lock:
+            self.db.execute(
+                "DELETE FROM rpc_cache WHERE height >= ?", (height,)
+            )
+
+            self.stored = self.db.execute(
+                "SELECT COALESCE(SUM(LENGTH(value)), 0) FROM rpc_cache"
+            ).fetchone()[0]
+
+
+class ResponseCache(object):
+    def __init__(self, memory=64 * 1024 * 1024, path=None, depth=6,
+                 disk=1024 * 1024 * 1024):
+        self.disk = DiskCache(path, disk) if path else None
+        self.memory = MemoryCache(memory)
+        self.depth = depth
+        self.hashes = {}
+        self.tip = None
+        self.updated = 0
+
+    @staticmethod
+    def key(method, params):
+        return json.dumps([method, params], separators=(",", ":"))
+
+    @staticmethod
+    def cacheable(method, params):
+        if method not in IMMUTABLE:
+            return False
+
+        if method == "getrawtransaction":
+            return len(params) > 1 and bool(params[1])
+
+        if method == "getblock":
+            return len(params) < 2 or params[1] != 0
+
+        return True
+
+    def refresh_due(self):
+        if time.time() - self.updated <= TIP_TTL:
+            return False
+
+        self.updated = time.time()
+        return True
+
+    def get(self, method, params):
+        if self.tip is None:
+            return None
+
+        key = self.key(method, params)
+        entry = self.memory.get(key)
+
+        if entry is None and self.disk:
+            if (entry := self.disk.get(key)):
+                self.memory.put(key, *entry)
+
+        if entry is None:
+            return None
+
+        height, value = entry
+
+        if height > self.tip:
+            return None
+
+        result = json.loads(value)
+        result["confirmations"] = self.tip - height + 1
+
+        return result
+
+    def put(self, method, params, result):
+        confirmations = result.get("confirmations", 0)
+
+        if self.tip is None or confirmations < self.depth:
+            return
+
+        if method == "getrawtransaction":
+            height = self.tip - confirmations + 1
+
+        else:
+            # Without a successor the next block can still be reorged away
+            if "nextblockhash" not in result:
+                return
+
+            height = result["height"]
+            self.hashes[height] = result["hash"]
+
+        value = dict(result)
+        value.pop("confirmations")
+        value = json.dumps(value, separators=(",", ":"))
+
+        self.memory.put(self.key(method, params), height, value)
+
+        if self.disk:
+            self.disk.put(self.key(method, params), height, value)
+
+    def observe(self, method, params, data, store=True):
+        if not isinstance(data, dict) or data.get("error") is not None:
+            return
+
+        result = data.get("result")
+        tip = None
+
+        if method == "getblockcount":
+            tip = result
+
+        elif method == "getblockchaininfo":
+            tip = result["blocks"]
+
+        elif method in ["getblock", "getblockheader"] and isinstance(result, dict):
+            if result.get("confirmations", 0) > 0:
+                tip = result["height"] + result["confirmations"] - 1
+
+        elif method == "getblockhash" and params:
+            known = self.hashes.get(params[0])
+
+            if known is not None and known != result:
+                self.invalidate(params[0])
+
+        if tip is not None:
+            self.set_tip(tip)
+
+        if store and self.cacheable(method, params) and isinstance(result, dict):
+            self.put(method, params, result)
+
+    def set_tip(self, tip):
+        if self.tip is not None and tip < self.tip:
+            self.invalidate(tip + 1)
+
+        self.updated = time.time()
+        self.tip = tip
+
+        if len(self.hashes) > HASH_WINDOW * 2:
+            self.hashes = {
+                height: bhash for height, bhash in self.hashes.items()
+                if height > tip - HASH_WINDOW
+            }
+
+    def invalidate(self, height):
+        self.hashes = {
+            known: bhash for known, bhash in self.hashes.items()
+            if known < height
+        }
+
+        self.memory.invalidate(height)
+
+        if self.disk:
+            self.disk.invalidate(height)
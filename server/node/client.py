@@ -0,0 +1,392 @@
+from urllib3.exceptions import NewConnectionError
+from requests.adapters import HTTPAdapter
+from contextlib import contextmanager
+from .flight import SingleFlight
+from collections import deque
+from .metrics import Metrics
+import threading
+import requests
+import queue
+import time
+import json
+
+# Statuses worth retrying: bitcoind answers 503 when its RPC work queue
+# is full. RPC level errors come back as 500 with a JSON body and must
+# be returned to the caller untouched.
+RETRY_STATUS = [502, 503, 504]
+
+# Calls with side effects are never coalesced with each other
+WRITE_METHODS = ["sendrawtransaction"]
+
+
+class NodeError(Exception):
+    pass
+
+
+class Node(object):
+    def __init__(self, url):
+        self.latency = deque(maxlen=200)
+        self.down_until = 0
+        self.errors = 0
+        self.tip = None
+        self.url = url
+
+    def record(self, elapsed, error=False):
+        # Exponentially weighted error rate over roughly the last 10 calls
+        self.errors = self.errors * 0.9 + (0.1 if error else 0)
+
+        if error:
+            self.down_until = time.time() + 5
+
+        else:
+            self.latency.append(elapsed)
+            self.down_until = 0
+
+    def percentile(self, value):
+        if len(self.latency) < 20:
+            return None
+
+        ordered = sorted(self.latency)
+        return ordered[int(value * (len(ordered) - 1))]
+
+    def display(self):
+        return {
+            "url": self.url.split("@")[-1],
+            "tip": self.tip,
+            "errors": round(self.errors, 4),
+            "down": self.down_until > time.time(),
+            "p50": self.percentile(0.5),
+            "p95": self.percentile(0.95)
+        }
+
+
+class NodeClient(object):
+    def __init__(self, endpoint, rid="api-server", pool=10,
+                 timeout=(3, 30), retries=3, backoff=0.25, batch=100,
+                 cache=None, metrics=None, hedge=None, lag=2, health=10):
+        endpoints = endpoint if isinstance(endpoint, list) else [endpoint]
+
+        self.nodes = [Node(url) for url in endpoints]
+        self.primary = self.nodes[0]
+        self.timeout = tuple(timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.metrics = metrics or Metrics()
+        self.flight = SingleFlight()
+        self.local = threading.local()
+        self.batch_size = batch
+        self.cache = cache
+        self.hedge = hedge
+        self.health = health
+        self.checked = 0
+        self.lag = lag
+        self.rid = rid
+        self.turn = 0
+
+        adapter = HTTPAdapter(
+            pool_connections=len(self.nodes), pool_maxsize=pool,
+            pool_block=True
+        )
+
+        self.session = requests.Session()
+        self.session.headers.update({"content-type": "text/plain;"})
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    @contextmanager
+    def pinned(self):
+        """Send every call made inside the block to the primary node"""
+        previous = getattr(self.local, "pinned", False)
+        self.local.pinned = True
+
+        try:
+            yield
+
+        finally:
+            self.local.pinned = previous
+
+    def is_pinned(self):
+        return getattr(self.local, "pinned", False)
+
+    def healthy(self):
+        now = time.time()
+        tips = [node.tip for node in self.nodes if node.tip is not None]
+        best = max(tips) if tips else None
+
+        return [
+            node for node in self.nodes
+            if node.down_until <= now and node.errors < 0.5
+            and (node.tip is None or best is None or node.tip >= best - self.lag)
+        ]
+
+    def pick(self, primary=False, exclude=None):
+        if len(self.nodes) == 1:
+            return self.primary
+
+        if time.time() - self.checked > self.health:
+            self.checked = time.time()
+            threading.Thread(target=self.check, daemon=True).start()
+
+        healthy = [node for node in self.healthy() if node is not exclude]
+
+        if not healthy:
+            healthy = [node for node in self.nodes if node is not exclude] or self.nodes
+
+        if primary and self.primary in healthy:
+            return self.primary
+
+        self.turn += 1
+        return healthy[self.turn % len(healthy)]
+
+    def backup(self, node):
+        """Next healthy node after node, leaves the round robin alone"""
+        healthy = [other for other in self.healthy() if other is not node]
+
+        if not healthy:
+            return None
+
+        position = self.nodes.index(node)
+        return min(
+            healthy, key=lambda other: (self.nodes.index(other) - position) % len(self.nodes)
+        )
+
+    def check(self):
+        data = json.dumps({"id": self.rid, "method": "getblockcount", "params": []})
+
+        for node in self.nodes:
+            try:
+                result, _ = self.send(node, data)
+                node.tip = result["result"]
+
+            except Exception:
+                pass
+
+    def send(self, node, data):
+        start = time.time()
+
+        try:
+            response = self.session.post(
+                node.url, data=data, timeout=self.timeout
+            )
+
+            if response.status_code in RETRY_STATUS:
+                raise NodeError(f"Node returned {response.status_code}")
+
+            result = response.json()
+
+        except Exception:
+            node.record(time.time() - start, True)
+            raise
+
+        node.record(time.time() - start)
+        return result, len(response.content)
+
+    def hedged(self, method, node, data):
+        threshold = node.percentile(self.hedge) if self.hedge else None
+
+        if threshold is None or (backup := self.backup(node)) is None:
+            return self.send(node, data)
+
+        results = queue.Queue()
+
+        def run(target):
+            try:
+                results.put((None, self.send(target, data)))
+
+            except Exception as error:
+                results.put((error, None))
+
+        threading.Thread(target=run, args=(node,), daemon=True).start()
+
+        try:
+            error, result = results.get(timeout=threshold)
+
+        except queue.Empty:
+            # The first node is slower than usual, race a second one
+            self.metrics.record_hedge(method)
+            threading.Thread(target=run, args=(backup,), daemon=True).start()
+
+            error, result = results.get()
+
+            if error is not None:
+                error, result = results.get()
+
+        if error is not None:
+            raise error
+
+        return result
+
+    @staticmethod
+    def unsent(error):
+        """Whether a request failed before any of it reached the node"""
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+
+        if isinstance(error, requests.Timeout) or not isinstance(error, requests.ConnectionError):
+            return False
+
+        reason = getattr(error.args[0] if error.args else None, "reason", None)
+        return isinstance(reason, NewConnectionError)
+
+    def transfer(self, method, data, primary, write=False):
+        node = self.pick(primary)
+        attempt = 0
+
+        while True:
+            try:
+                if primary:
+                    return node, self.send(node, data)
+
+                return node, self.hedged(method, node, data)
+
+            except (requests.ConnectionError, requests.Timeout, NodeError) as error:
+                # A write the node may have accepted must not be sent again
+                if attempt >= self.retries or (write and not self.unsent(error)):
+                    raise
+
+                time.sleep(self.backoff * (2 ** attempt))
+                node = self.pick(primary, exclude=node)
+                attempt += 1
+
+    def post(self, payload):
+        if isinstance(payload, dict):
+            methods = [payload["method"]]
+            method = payload["method"]
+
+        else:
+            methods = [item["method"] for item in payload]
+            method = "batch"
+
+        write = any(name in WRITE_METHODS for name in methods)
+        primary = self.is_pinned() or write
+
+        start = time.time()
+
+        try:
+            node, (data, size) = self.transfer(
+                method, json.dumps(payload), primary, write
+            )
+
+        except requests.Timeout:
+            self.metrics.record(method, time.time() - start, timeout=True)
+            raise
+
+        except Exception:
+            self.metrics.record(method, time.time() - start, error=True)
+            raise
+
+        error = isinstance(data, dict) and data.get("error") is not None
+        self.metrics.record(method, time.time() - start, size, error)
+
+        if method == "getblockcount" and not error:
+            node.tip = data["result"]
+
+        elif method == "getblockchaininfo" and not error:
+            node.tip = data["result"]["blocks"]
+
+        if isinstance(data, list):
+            methods = {item["id"]: item["method"] for item in payload}
+
+            for item in data:
+                self.metrics.record_item(
+                    methods.get(item.get("id"), "unknown"),
+                    item.get("error") is not None
+                )
+
+        return data
+
+    def status(self):
+        return [node.display() for node in self.nodes]
+
+    def flight_key(self, calls):
+        # Pinned callers must not be served by a read replica's answer
+        return json.dumps([self.is_pinned(), calls])
+
+    def call(self, method, params):
+        def fetch():
+            data = self.post(
+                {"id": self.rid, "method": method, "params": params}
+            )
+
+            if self.cache:
+                self.cache.observe(method, params, data, not self.is_pinned())
+
+            return data
+
+        if method in WRITE_METHODS:
+            return fetch()
+
+        return self.flight.do(self.flight_key([method, params]), fetch)
+
+    def call_batch(self, calls):
+        payload = [
+            {"id": index, "method": method, "params": params}
+            for index, (method, params) in enumerate(calls)
+        ]
+
+        data = self.post(payload)
+
+        if not isinstance(data, list):
+            raise NodeError("Node rejected batch request")
+
+        result = [None] * len(calls)
+
+        for item in data:
+            index = item["id"]
+            item["id"] = self.rid
+
+            if self.cache:
+                self.cache.observe(*calls[index], item, not self.is_pinned())
+
+            result[index] = item
+
+        if None in result:
+            raise NodeError("Node skipped batch entries")
+
+        return result
+
+    def cached(self, method, params):
+        # The sync reads every block once, caching it only costs a dump
+        if not self.cache or self.is_pinned() or not self.cache.cacheable(method, params):
+            return None
+
+        if self.cache.refresh_due():
+            self.call("getblockcount", [])
+
+        if (result := self.cache.get(method, params)) is not None:
+            self.metrics.record_hit(method)
+            return {"result": result, "error": None, "id": self.rid}
+
+        return None
+
+    def invalidate(self, height):
+        if self.cache:
+            self.cache.invalidate(height)
+
+    def request(self, method, params=[]):
+        if (data := self.cached(method, params)) is not None:
+            return data
+
+        return self.call(method, params)
+
+    def batch(self, calls):
+        result = [self.cached(method, params) for method, params in calls]
+        pending = [index for index, data in enumerate(result) if data is None]
+
+        for start in range(0, len(pending), self.batch_size):
+            chunk = pending[start:start + self.batch_size]
+            chunk_calls = [calls[index] for index in chunk]
+
+            if any(method in WRITE_METHODS for method, _ in chunk_calls):
+                data = self.call_batch(chunk_calls)
+
+            else:
+                data = self.flight.do(
+                    self.flight_key(chunk_calls),
+                    lambda: self.call_batch(chunk_calls)
+                )
+
+            for index, item in zip(chunk, data):
+                result[index] = item
+
+        return result
@@ -0,0 +1,62 @@
+import threading
+import json
+
+
+class Call(object):
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight(object):
+    # Concurrent callers with the same key share one in-flight call. The
+    # primitives come from threading, which the eventlet worker patches
+    # into their green equivalents, so this works in both worker types.
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+
+            if leader:
+                call = Call()
+                self.calls[key] = call
+
+            else:
+                call.waiters += 1
+
+        if not leader:
+            call.event.wait()
+
+            if call.error is not None:
+                raise call.error
+
+            return json.loads(call.result)
+
+        result = None
+
+        try:
+            result = fn()
+
+        except BaseException as error:
+            call.error = error
+            raise
+
+        finally:
+            with self.lock:
+                del self.calls[key]
+
+            if call.error is None and call.waiters:
+                # Callers mutate responses in place, so followers get
+                # their own copy of the result
+                call.result = json.dumps(result)
+
+            call.event.set()
+
+        return result
@@ -0,0 +1,128 @@
+from bisect import bisect_left
+import threading
+
+# Upper bounds of the latency histogram buckets, in seconds
+BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+
+
+class MethodStats(object):
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.timeouts = 0
+        self.hedges = 0
+        self.errors = 0
+        self.calls = 0
+        self.bytes = 0
+        self.hits = 0
+        self.time = 0
+
+    def display(self):
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "timeouts": self.timeouts,
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "hedges": self.hedges,
+            "time": round(self.time, 6),
+            "buckets": dict(zip(BUCKETS + ["+Inf"], self.buckets))
+        }
+
+
+class Metrics(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.methods = {}
+
+    def stats(self, method):
+        if method not in self.methods:
+            self.methods[method] = MethodStats()
+
+        return self.methods[method]
+
+    def record(self, method, elapsed, size=0, error=False, timeout=False):
+        with self.lock:
+            stats = self.stats(method)
+            stats.buckets[bisect_left(BUCKETS, elapsed)] += 1
+            stats.errors += int(error or timeout)
+            stats.timeouts += int(timeout)
+            stats.time += elapsed
+            stats.bytes += size
+            stats.calls += 1
+
+    def record_item(self, method, error=False):
+        # Entries of a batch share the round trip recorded under "batch"
+        with self.lock:
+            stats = self.stats(method)
+            stats.errors += int(error)
+            stats.calls += 1
+
+    def record_hit(self, method):
+        with self.lock:
+            self.stats(method).hits += 1
+
+    def record_hedge(self, method):
+        with self.lock:
+            self.stats(method).hedges += 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                method: stats.display()
+                for method, stats in self.methods.items()
+            }
+
+    @staticmethod
+    def diff(before, after):
+        result = {}
+
+        for method, stats in after.items():
+            previous = before.get(method, {})
+            result[method] = {
+                key: value - previous.get(key, 0)
+                for key, value in stats.items() if key != "buckets"
+            }
+
+        return result
+
+    @staticmethod
+    def summary(stats, limit=5):
+        top = sorted(stats.items(), key=lambda s: s[1]["time"], reverse=True)
+
+        return " ".join(
+            f"{method}={entry['calls']}/{round(entry['time'], 3)}s"
+            for method, entry in top[:limit] if entry["calls"] or entry["hits"]
+        )
+
+    def prometheus(self):
+        lines = [
+            "# TYPE plb_rpc_calls_total counter",
+            "# TYPE plb_rpc_errors_total counter",
+            "# TYPE plb_rpc_timeouts_total counter",
+            "# TYPE plb_rpc_bytes_total counter",
+            "# TYPE plb_rpc_cache_hits_total counter",
+            "# TYPE plb_rpc_hedges_total counter",
+            "# TYPE plb_rpc_latency_seconds histogram"
+        ]
+
+        for method, stats in sorted(self.snapshot().items()):
+            label = f'method="{method}"'
+
+            lines.append(f"plb_rpc_calls_total{{{label}}} {stats['calls']}")
+            lines.append(f"plb_rpc_errors_total{{{label}}} {stats['errors']}")
+            lines.append(f"plb_rpc_timeouts_total{{{label}}} {stats['timeouts']}")
+            lines.append(f"plb_rpc_bytes_total{{{label}}} {stats['bytes']}")
+            lines.append(f"plb_rpc_cache_hits_total{{{label}}} {stats['hits']}")
+            lines.append(f"plb_rpc_hedges_total{{{label}}} {stats['hedges']}")
+
+            count = 0
+            for bound, value in stats["buckets"].items():
+                count += value
+                lines.append(
+                    f'plb_rpc_latency_seconds_bucket{{{label},le="{bound}"}} {count}'
+                )
+
+            lines.append(f"plb_rpc_latency_seconds_sum{{{label}}} {stats['time']}")
+            lines.append(f"plb_rpc_latency_seconds_count{{{label}}} {count}")
+
+        return "\n".join(lines) + "\n"
@@ -40,6 +40,13 @@ class BlockService(object):
             orm.desc(Block.height)
         )
 
+    @classmethod
+    def hashes(cls, start, end):
+        return dict(orm.select(
+            (b.height, b.blockhash) for b in Block
+            if b.height >= start and b.height <= end
+        ))
+
     @classmethod
     def chart(cls):
         query = orm.select((b.height, len(b.transactions)) for b in Block)
@@ -112,13 +119,13 @@ class OutputService(object):
     @classmethod
     def locked_height(cls, address, height, currency="PLB"):
         return orm.select(
-            sum(o.amount) for o in Output if o.spent is False and o.address == address and o.currency == currency and o.timelock <= 500000000 and o.timelock > height
+            sum(o.amount) for o in Output if o.spent_by is None and o.address == address and o.currency == currency and o.timelock <= 500000000 and o.timelock > height
         ).first()
 
     @classmethod
     def locked_time(cls, address, time, currency="PLB"):
         return orm.select(
-            sum(o.amount) for o in Output if o.spent is False and o.address == address and o.currency == currency and o.timelock > 500000000 and o.timelock > time
+            sum(o.amount) for o in Output if o.spent_by is None and o.address == address and o.currency == currency and o.timelock > 500000000 and o.timelock > time
         ).first()
 
 class TokenService(object):
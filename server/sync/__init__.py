@@ -0,0 +1,456 @@
+from ..methods.transaction import Transaction
+from ..services import BlockService
+from ..methods.block import Block
+from ..utils import make_request
+from .log import log_block, log_message
+from .pipeline import Prefetcher
+from .mempool import MempoolTracker
+from .checkpoint import Checkpoint
+from .scheduler import SyncScheduler
+from .follow import TipFollower
+from .tokens import TokenRegistry, token_category
+from .stats import SyncStats, memory
+from .headers import HeaderChain
+from .writer import BlockWriter
+from . import schema
+from ..node import client, metrics
+from ..node import Metrics
+from datetime import datetime
+from pony import orm
+from .. import utils
+import config
+import time
+
+MEMPOOL_HEIGHT = 999999999999
+
+SYNC = {
+    "workers": 4, "prefetch": 32, "utxo_cache": 500000,
+    "address_cache": 200000, "ibd": 1000, "ibd_commit": 100,
+    "undo": 1000, "longpoll": 25, "poll": 5, "status": None,
+    "session": 1000, "mempool": 30, "tokens": 21600,
+    **getattr(config, "sync", {})
+}
+
+# Kept across passes so the caches stay warm
+writer = BlockWriter(SYNC["utxo_cache"], SYNC["address_cache"])
+headers = HeaderChain(SYNC["undo"])
+registry = TokenRegistry(writer)
+checkpoint = Checkpoint()
+stats = SyncStats()
+
+# Separate writer so mempool outputs never enter the block UTXO cache,
+# they can still be evicted along with their transaction
+mempool = MempoolTracker(BlockWriter(address_cache=SYNC["address_cache"]))
+
+@client.pinned()
+def process_transaction(txid):
+    """Store a transaction the node accepted from a wallet broadcast,
+    written like the mempool job would so it can't race the sync
+    """
+    with mempool.lock:
+        try:
+            mempool.add([txid])
+            orm.commit()
+
+        finally:
+            # Called from the API processes as well, ids cached there
+            # would go stale as the sync process moves on
+            mempool.writer.reset()
+
+@client.pinned()
+@orm.db_session
+def sync_tokens():
+    registry.reconcile()
+
+def block_reward(block_data, transactions):
+    """Reward in satoshis, None when the coinstake inputs need a lookup"""
+    if block_data["height"] == 0:
+        return 0
+
+    if not block_data["stake"]:
+        return transactions[block_data["tx"][0]]["vout"][0]["value"]
+
+    coinstake = transactions[block_data["tx"][1]]
+
+    if not all("valueSat" in vin for vin in coinstake["vin"]):
+        return None
+
+    inputs = sum(vin["valueSat"] for vin in coinstake["vin"])
+    return coinstake["amount"] - inputs
+
+def stake_reward(coinstake):
+    # Coinstake inputs are old enough to be in the db already
+    prevouts = writer.resolve(
+        (vin["txid"], vin["vout"]) for vin in coinstake["vin"]
+    )
+
+    inputs = sum(int(amount * 10 ** 8) for *_, amount in prevouts.values())
+    return coinstake["amount"] - inputs
+
+@client.pinned()
+def fetch_block(height):
+    started = time.time()
+    data = make_request("getblockhash", [height])
+
+    if data["error"] is not None:
+        return None
+
+    # Verbosity 2 embeds the decoded transactions
+    data = make_request("getblock", [data["result"], 2])
+
+    if data["error"] is not None:
+        return None
+
+    fetched = time.time()
+    block_data = data["result"]
+    block_data["stake"] = block_data["flags"] == "proof-of-stake"
+    block_data["txcount"] = len(block_data["tx"])
+    transactions = {}
+
+    for tx_data in block_data["tx"]:
+        tx_data.setdefault("timestamp", block_data["time"])
+        transactions[tx_data["txid"]] = Transaction.prepare(tx_data)
+
+    block_data["tx"] = [tx_data["txid"] for tx_data in block_data["tx"]]
+    block_data["reward"] = block_reward(block_data, transactions)
+
+    stats.add(fetch_time=fetched - started, decode_time=time.time() - fetched)
+
+    return block_data, transactions
+
+def find_fork(latest_block):
+    window = 16
+
+    while True:
+        start = max(latest_block.height - window + 1, 0)
+        fork = headers.fork(BlockService.hashes(start, latest_block.height))
+
+        if fork is not None:
+            return fork
+
+        # Even genesis differs, this db belongs to another chain
+        if start == 0:
+            raise RuntimeError("No block in common with the node, not rolling back")
+
+        window *= 2
+
+def rollback(latest_block):
+    """Undo blocks above the last one the node agrees with"""
+    headers.clear()
+    fork = find_fork(latest_block)
+    stats.reorg(latest_block.height - fork)
+
+    while latest_block.height > fork:
+        log_block("Rolling back", latest_block)
+
+        reorg_block = latest_block
+        latest_block = reorg_block.previous_block
+        client.invalidate(reorg_block.height)
+
+        writer.undo(reorg_block)
+        checkpoint.advance(
+            reorg_block.blockhash, latest_block.height,
+            latest_block.blockhash, latest_block.height, "normal"
+        )
+        reorg_block.delete()
+        orm.commit()
+
+        stats.set(db_height=latest_block.height, last_commit=time.time())
+
+    # Transactions of the undone blocks are back at MEMPOOL_HEIGHT
+    mempool.known = None
+
+    return latest_block
+
+def create_genesis():
+    data = Block.height(0)["result"]
+    created = datetime.fromtimestamp(data["time"])
+    signature = data["signature"] if "signature" in data else None
+
+    block = BlockService.create(
+        utils.amount(data["reward"]), data["hash"], data["height"], created,
+        data["merkleroot"], data["chainwork"],
+        data["version"], data["weight"], data["stake"], data["nonce"],
+        data["size"], data["bits"], signature
+    )
+
+    log_block("Genesis block", block)
+
+    orm.commit()
+
+@orm.db_session
+def prepare_sync():
+    """Line the db tip up with the node, returns the node height and
+    the height and hash of the db tip
+    """
+    if not BlockService.latest_block():
+        create_genesis()
+
+    data = make_request("getblockchaininfo")
+
+    if data["error"] is not None:
+        log_message("Failed to get node tip, retrying next pass")
+        return None
+
+    current_height = data["result"]["blocks"]
+    stats.set(node_height=current_height)
+    headers.tip(current_height, data["result"]["bestblockhash"])
+    latest_block = BlockService.latest_block()
+
+    log_message(f"Current node height: {current_height}, db height: {latest_block.height}")
+    stats.set(db_height=latest_block.height)
+
+    # Picks up where a crashed pass last committed, nothing after that
+    # point made it to the db so nothing is applied twice
+    checkpoint.resume(
+        latest_block,
+        "ibd" if current_height - latest_block.height > SYNC["ibd"] else "normal"
+    )
+    orm.commit()
+
+    if current_height < latest_block.height:
+        headers.clear()
+
+    if (node_hash := headers.get(latest_block.height)) is None:
+        log_message(f"Failed to get node hash at height {latest_block.height}, retrying next pass")
+        return None
+
+    if node_hash != latest_block.blockhash:
+        log_block("Found reorg", latest_block)
+        latest_block = rollback(latest_block)
+
+    # Initial block download: far behind the node, trade per block
+    # durability and secondary indexes for throughput until caught up
+    if current_height - latest_block.height > SYNC["ibd"]:
+        log_message(f"Initial block download, committing every {SYNC['ibd_commit']} blocks")
+        schema.defer_indexes()
+
+    return current_height, latest_block.height, latest_block.blockhash
+
+@orm.db_session
+def sync_batch(prefetcher, blocks, tip, current_height):
+    """Write up to sync["session"] blocks from the pipeline in one session
+
+    Pony holds on to every entity a session loads until it ends, so a
+    long catch up gets a fresh session per batch. Only the tip hash and
+    the writer caches carry over. Returns the new tip and whether the
+    pipeline has more blocks for this pass.
+    """
+    latest_block = BlockService.get_by_hash(tip)
+    peak = memory()[0]
+    more = False
+    count = 0
+
+    try:
+        for height, fetched in blocks:
+            count += 1
+
+            if not fetched:
+                log_message(f"Failed to fetch block {height}, retrying next pass")
+                break
+
+            block_data, transactions = fetched
+
+            # Blocks are fetched ahead, the chain could have moved since
+            if block_data["previousblockhash"] != latest_block.blockhash:
+                log_message(f"Block {height} does not extend db tip, retrying next pass")
+                headers.clear()
+                break
+
+            written = time.time()
+            created = datetime.fromtimestamp(block_data["time"])
+            signature = block_data["signature"] if "signature" in block_data else None
+
+            if block_data["reward"] is None:
+                block_data["reward"] = stake_reward(transactions[block_data["tx"][1]])
+
+            block = BlockService.create(
+                utils.amount(block_data["reward"]), block_data["hash"], block_data["height"], created,
+                block_data["merkleroot"], block_data["chainwork"],
+                block_data["version"], block_data["weight"], block_data["stake"], block_data["nonce"],
+                block_data["size"], block_data["bits"], signature
+            )
+
+            block.previous_block = latest_block
+            orm.flush()
+
+            log_block("New block", block, block_data["tx"])
+
+            txids = [
+                txid for index, txid in enumerate(block_data["tx"])
+                if not (block.stake and index == 0)
+            ]
+
+            # Mempool transactions can't conflict with blocks this deep
+            deep = current_height - height > SYNC["ibd"]
+
+            # Confirm mempool transactions, write the rest in bulk
+            existing = writer.confirm(block, txids)
+
+            undo = writer.write(
+                block, {
+                    txid: transactions[txid] for txid in txids
+                    if txid not in existing
+                }, block.height,
+                coinbase=None if block.stake else block_data["tx"][0],
+                coinstake=block_data["tx"][1] if block.stake else None,
+                conflicts=not deep
+            )
+
+            # Only the last sync["undo"] blocks keep a record, rollback
+            # derives the rest
+            if current_height - height <= SYNC["undo"]:
+                writer.journal(block, undo, existing.values())
+
+            # Same transaction as the block, they commit together
+            checkpoint.advance(
+                latest_block.blockhash, height, block.blockhash,
+                prefetcher.position, "ibd" if deep else "normal"
+            )
+
+            headers.add(height, block.blockhash)
+            latest_block = block
+
+            committed = time.time()
+
+            if not deep or height % SYNC["ibd_commit"] == 0:
+                orm.commit()
+                writer.commit()
+                stats.set(db_height=height, last_commit=time.time())
+                peak = max(peak, memory()[0])
+
+            stats.block(len(txids))
+            stats.add(
+                blocks=1, transactions=len(txids),
+                inputs=sum(len(transactions[txid]["vin"]) for txid in txids),
+                outputs=sum(len(transactions[txid]["vout"]) for txid in txids),
+                write_time=committed - written,
+                commit_time=time.time() - committed
+            )
+
+            if count == SYNC["session"]:
+                more = True
+                break
+
+        orm.commit()
+        writer.commit()
+        stats.set(db_height=latest_block.height, last_commit=time.time())
+
+    except Exception:
+        # Ids learned in the rolled back blocks never made it to the db
+        writer.rollback()
+        raise
+
+    finally:
+        if count:
+            rss, peak_rss = memory()
+            peak = max(peak, rss)
+            stats.set(rss_mb=rss, batch_peak_rss_mb=peak, peak_rss_mb=peak_rss)
+            log_message(f"Session of {count} blocks up to {latest_block.height}: rss {rss} MB, batch peak {peak} MB, process peak {peak_rss} MB")
+
+    return latest_block.blockhash, more
+
+@orm.db_session
+def finish_sync(current_height, tip):
+    latest_block = BlockService.get_by_hash(tip)
+
+    # Back to following the tip, build whatever the download deferred
+    if current_height - latest_block.height <= SYNC["ibd"]:
+        schema.restore_indexes()
+
+    # Tokens issued or reissued in the blocks written this pass
+    if writer.tokens:
+        registry.refresh(writer.tokens)
+        writer.tokens = {}
+
+    writer.prune(latest_block.height - SYNC["undo"])
+    orm.commit()
+
+@client.pinned()
+def sync_blocks():
+    rpc_before = metrics.snapshot()
+
+    if not (prepared := prepare_sync()):
+        return None
+
+    current_height, latest_height, tip = prepared
+    heights = range(latest_height + 1, current_height + 1)
+    rows = writer.rows
+    hits, misses = writer.utxos.hits, writer.utxos.misses
+    started = time.time()
+
+    with Prefetcher(fetch_block, heights, SYNC["workers"], SYNC["prefetch"]) as prefetcher:
+        blocks = iter(prefetcher)
+        more = True
+
+        while more:
+            tip, more = sync_batch(prefetcher, blocks, tip, current_height)
+
+        stats.add(fetch_wait=prefetcher.waited)
+
+    if (rows := writer.rows - rows):
+        stats.add(rows=rows)
+        elapsed = time.time() - started
+        lookups = writer.utxos.hits - hits + writer.utxos.misses - misses
+        ratio = (writer.utxos.hits - hits) / lookups if lookups else 0
+
+        log_message(f"Wrote {rows} rows in {elapsed:.1f}s ({int(rows / elapsed)} rows/s), utxo cache hits {ratio:.0%}")
+
+    finish_sync(current_height, tip)
+
+    rpc_stats = Metrics.diff(rpc_before, metrics.snapshot())
+    log_message(f"RPC usage: {Metrics.summary(rpc_stats)}")
+
+    return tip
+
+@client.pinned()
+@orm.db_session
+def sync_mempool():
+    # Benchmarks and tools call it outside the scheduler too
+    with mempool.lock:
+        try:
+            changed = mempool.sync()
+            orm.commit()
+            mempool.writer.commit()
+            stats.set(mempool=len(mempool.known or []))
+
+        except Exception:
+            # Whatever the pass added is gone, start over from the db,
+            # address ids it inserted included
+            mempool.writer.rollback()
+            mempool.known = None
+            raise
+
+    return changed
+
+def sync_chain():
+    blocks = stats.snapshot()["blocks"]
+    tip = sync_blocks()
+
+    # The blocks confirmed some of the mempool, catch up right after
+    if stats.snapshot()["blocks"] != blocks:
+        scheduler.request("mempool")
+
+    return tip
+
+# Every write to the chain tables goes through one thread, in priority
+# order, so the jobs never contend for the same rows
+scheduler = SyncScheduler()
+scheduler.add("blocks", sync_chain, 0)
+scheduler.add(
+    "mempool", sync_mempool, 1, SYNC["mempool"],
+    SYNC["mempool"] / 6, SYNC["mempool"] * 4
+)
+scheduler.add("tokens", sync_tokens, 2, SYNC["tokens"])
+
+def follow_tip():
+    # Queued before the thread starts so the catch up goes first, the
+    # token reconcile would otherwise wait a full interval
+    scheduler.request("blocks")
+    scheduler.request("tokens")
+    scheduler.start()
+
+    TipFollower(
+        lambda: scheduler.request("blocks", wait=True),
+        SYNC["longpoll"], SYNC["poll"]
+    ).run()
@@ -0,0 +1,379 @@
+"""Historical backfill across processes
+
+The height range is split into shards that a process pool fetches and
+decodes independently, writing rows keyed by txid and address string to
+staging tables. A single merge then moves them into the chain tables with
+set based SQL, which is where spends across shards get resolved and
+balances computed. Run it with the tip follower stopped.
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from . import fetch_block, create_genesis, registry, SYNC
+from .schema import defer_indexes, restore_indexes
+from .checkpoint import Checkpoint
+from ..models import MEMPOOL_HEIGHT, db
+from .writer import BlockWriter, decimal
+from ..services import BlockService
+from .tokens import TOKEN_EVENTS
+from .pipeline import Prefetcher
+from .log import log_message
+from datetime import datetime
+from ..node import client
+import multiprocessing
+from pony import orm
+from .. import utils
+import time
+import os
+
+STAGING = {
+    "stage_blocks": (
+        "height INT PRIMARY KEY, hash VARCHAR(64), previous VARCHAR(64), "
+        "reward DECIMAL(20, 8) NULL, coinstake VARCHAR(64) NULL, "
+        "created DATETIME, merkleroot VARCHAR(64), chainwork VARCHAR(64), "
+        "version BIGINT, weight INT, stake BOOL, nonce BIGINT, size INT, "
+        "bits VARCHAR(16), signature TEXT NULL"
+    ),
+    "stage_transactions": (
+        "txid VARCHAR(64), height INT, position INT, "
+        "amount DECIMAL(20, 8), coinbase BOOL, coinstake BOOL, "
+        "created DATETIME, locktime BIGINT, size INT, INDEX (txid)"
+    ),
+    "stage_outputs": (
+        "txid VARCHAR(64), n INT, address VARCHAR(255), currency VARCHAR(255), "
+        "amount DECIMAL(20, 8), amount_raw BIGINT, timelock BIGINT, "
+        "category VARCHAR(255), raw TEXT, height INT"
+    ),
+    "stage_inputs": (
+        "txid VARCHAR(64), sequence BIGINT, previous VARCHAR(64), vout INT"
+    )
+}
+
+
+def shards(start, end, size):
+    return [
+        (low, min(low + size - 1, end))
+        for low in range(start, end + 1, size)
+    ]
+
+
+def create_staging(cursor):
+    for table, columns in STAGING.items():
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {table} ({columns}) ENGINE=InnoDB")
+        cursor.execute(f"TRUNCATE TABLE {table}")
+
+
+def drop_staging(cursor):
+    for table in STAGING:
+        cursor.execute(f"DROP TABLE IF EXISTS {table}")
+
+
+def flush(writer, rows):
+    """Write the buffered staging rows and commit them"""
+    for table, values in rows.items():
+        if values:
+            writer.execute(
+                f"INSERT INTO {table} VALUES ({', '.join(['%s'] * len(values[0]))})",
+                values
+            )
+
+            values.clear()
+
+    orm.commit()
+
+
+def stage(shard):
+    """Fetch and decode one shard into the staging tables, in a worker"""
+    low, high = shard
+    writer = BlockWriter()
+    started = time.time()
+
+    with client.pinned(), orm.db_session:
+        rows = {table: [] for table in STAGING}
+        blocks, transactions = rows["stage_blocks"], rows["stage_transactions"]
+        outputs, inputs = rows["stage_outputs"], rows["stage_inputs"]
+
+        with Prefetcher(fetch_block, range(low, high + 1), SYNC["workers"], SYNC["prefetch"]) as fetched:
+            for height, result in fetched:
+                if not result:
+                    raise RuntimeError(f"Failed to fetch block {height}")
+
+                block_data, decoded = result
+                stake = block_data["stake"]
+
+                blocks.append((
+                    height, block_data["hash"], block_data.get("previousblockhash"),
+                    None if block_data["reward"] is None else utils.amount(block_data["reward"]),
+                    block_data["tx"][1] if stake else None,
+                    datetime.fromtimestamp(block_data["time"]),
+                    block_data["merkleroot"], block_data["chainwork"],
+                    block_data["version"], block_data["weight"], stake,
+                    block_data["nonce"], block_data["size"], block_data["bits"],
+                    block_data.get("signature")
+                ))
+
+                for position, txid in enumerate(block_data["tx"]):
+                    # The coinbase of a proof-of-stake block is empty
+                    if stake and position == 0:
+                        continue
+
+                    tx_data = decoded[txid]
+
+                    transactions.append((
+                        txid, height, position, decimal(utils.amount(tx_data["amount"])),
+                        not stake and position == 0, stake and position == 1,
+                        datetime.fromtimestamp(tx_data["timestamp"]),
+                        tx_data["locktime"], tx_data["size"]
+                    ))
+
+                    for vin in tx_data["vin"]:
+                        if "coinbase" not in vin:
+                            inputs.append((txid, vin["sequence"], vin["txid"], vin["vout"]))
+
+                    for vout in writer.outputs(tx_data):
+                        amount, amount_raw, currency, timelock = writer.value(vout)
+
+                        outputs.append((
+                            txid, vout["n"], vout["scriptPubKey"]["addresses"][0],
+                            currency, decimal(amount), amount_raw, timelock,
+                            vout["scriptPubKey"]["type"], vout["scriptPubKey"]["hex"],
+                            height
+                        ))
+
+                # Bounded like the sync's own initial download commits
+                if height % SYNC["ibd_commit"] == 0:
+                    flush(writer, rows)
+
+        flush(writer, rows)
+
+    return shard, writer.rows, time.time() - started
+
+
+def link_column(cursor):
+    # Pony keeps the one-to-one previous/next block link in one column
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = DATABASE() AND table_name = 'chain_blocks' "
+        "AND column_name IN ('previous_block', 'next_block')"
+    )
+
+    return cursor.fetchone()[0]
+
+
+def max_id(cursor, table):
+    cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {table}")
+    return cursor.fetchone()[0]
+
+
+def merge(cursor, start):
+    """Move the staged rows into the chain tables"""
+    cursor.execute(
+        "SELECT COUNT(*) FROM stage_blocks s "
+        "LEFT JOIN stage_blocks p ON p.height = s.height - 1 "
+        "LEFT JOIN chain_blocks c ON c.height = s.height - 1 "
+        "WHERE s.previous <> COALESCE(p.hash, c.blockhash)"
+    )
+
+    if cursor.fetchone()[0]:
+        raise RuntimeError("Staged blocks do not form a chain, was there a reorg?")
+
+    transactions = max_id(cursor, "chain_transactions")
+    outputs = max_id(cursor, "chain_outputs")
+    inputs = max_id(cursor, "chain_inputs")
+    steps = [
+        (
+            "blocks",
+            "INSERT INTO chain_blocks (reward, signature, blockhash, height, "
+            "created, merkleroot, chainwork, version, weight, stake, nonce, "
+            "size, bits) "
+            "SELECT COALESCE(reward, 0), signature, hash, height, created, "
+            "merkleroot, chainwork, version, weight, stake, nonce, size, bits "
+            "FROM stage_blocks ORDER BY height"
+        ),
+        (
+            "block links",
+            "UPDATE chain_blocks b JOIN chain_blocks o ON o.height = b.height {} 1 "
+            "SET b.{} = o.id WHERE b.height >= %s"
+        ),
+        (
+            "addresses",
+            "INSERT IGNORE INTO chain_addresses (address) "
+            "SELECT DISTINCT address FROM stage_outputs"
+        ),
+        (
+            "transactions",
+            "INSERT INTO chain_transactions (amount, coinstake, coinbase, txid, "
+            "height, created, locktime, size, block) "
+            "SELECT s.amount, s.coinstake, s.coinbase, s.txid, s.height, "
+            "s.created, s.locktime, s.size, b.id FROM stage_transactions s "
+            "JOIN chain_blocks b ON b.height = s.height "
+            "ORDER BY s.height, s.position"
+        ),
+        (
+            "outputs",
+            "INSERT INTO chain_outputs (amount, currency, timelock, amount_raw, "
+            "address, category, raw, txid, n, transaction) "
+            "SELECT s.amount, s.currency, s.timelock, s.amount_raw, a.id, "
+            "s.category, s.raw, s.txid, s.n, t.id FROM stage_outputs s "
+            "JOIN chain_transactions t ON t.txid = s.txid "
+            "JOIN chain_addresses a ON a.address = s.address "
+            f"WHERE t.id > {transactions} ORDER BY t.id, s.n"
+        ),
+        (
+            "inputs",
+            "INSERT INTO chain_inputs (sequence, n, transaction, vout) "
+            "SELECT s.sequence, s.vout, t.id, o.id FROM stage_inputs s "
+            "JOIN chain_transactions t ON t.txid = s.txid "
+            "JOIN chain_transactions p ON p.txid = s.previous "
+            "JOIN chain_outputs o ON o.transaction = p.id AND o.n = s.vout "
+            f"WHERE t.id > {transactions} ORDER BY t.id"
+        ),
+        (
+            "spends",
+            "UPDATE chain_outputs o JOIN chain_inputs i ON i.vout = o.id "
+            "JOIN chain_transactions t ON t.id = i.transaction "
+            "SET o.spent_by = i.transaction, o.spent_height = t.height "
+            f"WHERE i.id > {inputs}"
+        ),
+        (
+            "stake rewards",
+            "UPDATE chain_blocks b JOIN stage_blocks s ON s.hash = b.blockhash "
+            "JOIN chain_transactions t ON t.txid = s.coinstake "
+            "JOIN (SELECT i.transaction, SUM(o.amount) AS spent FROM chain_inputs i "
+            "JOIN chain_outputs o ON o.id = i.vout "
+            f"WHERE i.id > {inputs} GROUP BY i.transaction) x "
+            "ON x.transaction = t.id "
+            "SET b.reward = t.amount - x.spent WHERE s.reward IS NULL"
+        ),
+        (
+            "address transactions",
+            "INSERT IGNORE INTO chain_address_transactions (address, transaction) "
+            f"SELECT address, transaction FROM chain_outputs WHERE id > {outputs} "
+            "UNION SELECT o.address, i.transaction FROM chain_inputs i "
+            f"JOIN chain_outputs o ON o.id = i.vout WHERE i.id > {inputs}"
+        ),
+        (
+            "balances",
+            "INSERT INTO chain_address_balance (balance, address, currency) "
+            "SELECT SUM(amount), address, currency FROM ("
+            f"SELECT address, currency, amount FROM chain_outputs WHERE id > {outputs} "
+            "UNION ALL SELECT o.address, o.currency, -o.amount FROM chain_inputs i "
+            f"JOIN chain_outputs o ON o.id = i.vout WHERE i.id > {inputs}"
+            ") d GROUP BY address, currency "
+            "ON DUPLICATE KEY UPDATE balance = balance + VALUES(balance)"
+        ),
+        (
+            "transaction index",
+            "INSERT INTO chain_transaction_index (currency, amount, transaction, created) "
+            "SELECT o.currency, SUM(o.amount), o.transaction, t.created "
+            "FROM chain_outputs o JOIN chain_transactions t ON t.id = o.transaction "
+            f"WHERE o.id > {outputs} GROUP BY o.transaction, o.currency, t.created"
+        )
+    ]
+
+    column = link_column(cursor)
+
+    for name, sql in steps:
+        started = time.time()
+
+        # The join below would silently skip inputs it can't resolve
+        if name == "inputs":
+            missing_prevouts(cursor)
+
+        if name == "block links":
+            cursor.execute(
+                sql.format("-" if column == "previous_block" else "+", column),
+                [max(start - 1, 0)]
+            )
+
+        else:
+            cursor.execute(sql)
+
+        log_message(f"Merged {name}: {cursor.rowcount} rows in {time.time() - started:.1f}s")
+
+
+def missing_prevouts(cursor):
+    cursor.execute(
+        "SELECT COUNT(*), MIN(CONCAT(s.previous, ':', s.vout)) FROM stage_inputs s "
+        "LEFT JOIN chain_transactions p ON p.txid = s.previous "
+        "LEFT JOIN chain_outputs o ON o.transaction = p.id AND o.n = s.vout "
+        "WHERE o.id IS NULL"
+    )
+
+    count, example = cursor.fetchone()
+
+    if count:
+        raise RuntimeError(f"{count} staged inputs spend unknown outputs, e.g. {example}")
+
+
+def issued(cursor):
+    cursor.execute(
+        "SELECT s.currency, s.height, b.hash FROM stage_outputs s "
+        "JOIN stage_blocks b ON b.height = s.height "
+        f"WHERE s.category IN ({', '.join(['%s'] * len(TOKEN_EVENTS))})",
+        TOKEN_EVENTS
+    )
+
+    return {name: (height, bhash) for name, height, bhash in cursor.fetchall()}
+
+
+def backfill(end, processes=None, size=None):
+    """Fill the db from its tip up to end"""
+    processes = processes or multiprocessing.cpu_count()
+
+    with client.pinned(), orm.db_session:
+        if not BlockService.latest_block():
+            create_genesis()
+
+        start = BlockService.latest_block().height + 1
+
+        if end < start:
+            log_message(f"Nothing to backfill, db is at {start - 1}")
+            return
+
+        # Mempool rows could collide with the staged ones, the tip
+        # follower loads them again once it runs
+        cursor = db.get_connection().cursor()
+        cursor.execute(
+            "SELECT id FROM chain_transactions WHERE height = %s", [MEMPOOL_HEIGHT]
+        )
+
+        if (pending := [tid for tid, in cursor.fetchall()]):
+            BlockWriter().evict(pending)
+
+        create_staging(cursor)
+        orm.commit()
+        defer_indexes()
+
+    size = size or max((end - start + 1) // (processes * 4), 1)
+    started = time.time()
+
+    log_message(f"Backfilling {start}-{end} with {processes} processes")
+
+    # Spawned so every worker builds its own node client and db connection.
+    # Workers must not map with create_tables, that would rebuild the
+    # indexes deferred above, concurrently in every process.
+    context = multiprocessing.get_context("spawn")
+    os.environ["PLB_CREATE_TABLES"] = "0"
+
+    try:
+        with ProcessPoolExecutor(processes, mp_context=context) as pool:
+            for future in as_completed([pool.submit(stage, shard) for shard in shards(start, end, size)]):
+                (low, high), rows, elapsed = future.result()
+                log_message(f"Staged {low}-{high}: {rows} rows in {elapsed:.1f}s")
+
+    finally:
+        os.environ.pop("PLB_CREATE_TABLES")
+
+    with client.pinned(), orm.db_session:
+        cursor = db.get_connection().cursor()
+
+        merge(cursor, start)
+        registry.refresh(issued(cursor))
+
+        cursor.execute("SELECT hash FROM stage_blocks WHERE height = %s", [end])
+        Checkpoint().save(end, cursor.fetchone()[0], end, "backfill")
+        orm.commit()
+
+        drop_staging(cursor)
+        restore_indexes()
+
+    log_message(f"Backfilled {end - start + 1} blocks in {time.time() - started:.1f}s")
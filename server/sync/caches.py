@@ -0,0 +1,36 @@
+from collections import OrderedDict
+
+
+class LRU(object):
+    """Entry-bounded least recently used mapping"""
+
+    def __init__(self, size):
+        self.entries = OrderedDict()
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        if key not in self.entries:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return self.entries[key]
+
+    def put(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def pop(self, key):
+        return self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
@@ -0,0 +1,87 @@
+from .log import log_message
+from datetime import datetime
+from ..models import db
+
+NAME = "blocks"
+
+
+class CheckpointError(Exception):
+    pass
+
+
+class Checkpoint(object):
+    """Last fully applied block, kept in chain_sync_state
+
+    Every change is made on the connection of the current db_session, so
+    it commits or rolls back together with the block rows it describes.
+    """
+
+    def __init__(self, name=NAME):
+        self.name = name
+
+    @staticmethod
+    def cursor():
+        return db.get_connection().cursor()
+
+    def load(self):
+        cursor = self.cursor()
+        cursor.execute(
+            "SELECT height, blockhash, position, mode FROM chain_sync_state "
+            "WHERE name = %s", [self.name]
+        )
+
+        if not (row := cursor.fetchone()):
+            return None
+
+        return dict(zip(["height", "blockhash", "position", "mode"], row))
+
+    def save(self, height, blockhash, position, mode):
+        self.cursor().execute(
+            "INSERT INTO chain_sync_state (name, height, blockhash, position, mode, updated) "
+            "VALUES (%s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE "
+            "height = VALUES(height), blockhash = VALUES(blockhash), "
+            "position = VALUES(position), mode = VALUES(mode), updated = VALUES(updated)",
+            [self.name, height, blockhash, position, mode, datetime.now()]
+        )
+
+    def advance(self, previous, height, blockhash, position, mode):
+        """Move the checkpoint off previous, fails if it is somewhere else
+
+        A block whose effects were already applied, by an earlier run or
+        another sync process, never gets past this and its transaction
+        rolls back instead of adding its balances a second time.
+        """
+        cursor = self.cursor()
+        cursor.execute(
+            "UPDATE chain_sync_state SET height = %s, blockhash = %s, "
+            "position = %s, mode = %s, updated = %s "
+            "WHERE name = %s AND blockhash = %s",
+            [height, blockhash, position, mode, datetime.now(), self.name, previous]
+        )
+
+        if cursor.rowcount != 1:
+            raise CheckpointError(f"Checkpoint is not at {previous}, refusing to apply {blockhash}")
+
+    def resume(self, latest_block, mode):
+        """Line the checkpoint up with the db tip before a pass"""
+        state = self.load()
+
+        if state is None:
+            log_message(f"No sync checkpoint, starting one at {latest_block.height}")
+
+        elif state["blockhash"] == latest_block.blockhash:
+            if state["mode"] != mode:
+                log_message(f"Resuming at {state['height']} after {state['mode']} mode")
+
+            if state["position"] > state["height"]:
+                log_message(f"Blocks {state['height'] + 1}-{state['position']} were fetched but not applied, fetching again")
+
+            return state
+
+        else:
+            # Only writers that predate the checkpoint (or the backfill
+            # staging tables) can move the tip without moving it
+            log_message(f"Sync checkpoint at {state['height']} does not match db tip {latest_block.height}, realigning")
+
+        self.save(latest_block.height, latest_block.blockhash, latest_block.height, mode)
+        return self.load()
@@ -0,0 +1,67 @@
+from ..utils import make_request
+from .log import log_message
+from ..node import client
+import time
+
+# JSON-RPC "Method not found"
+METHOD_NOT_FOUND = -32601
+
+
+class TipFollower(object):
+    """Runs the sync callback whenever the node's best block changes
+
+    Waits on the node with the waitfornewblock long-poll, so new blocks
+    are picked up as soon as the node has them and an idle node costs one
+    call per timeout. Nodes without it, or errors, fall back to polling
+    every interval seconds.
+    """
+
+    def __init__(self, callback, timeout=25, interval=5):
+        self.callback = callback
+        self.interval = interval
+        self.timeout = timeout
+        self.longpoll = True
+        self.tip = None
+
+    def best(self):
+        data = make_request("getbestblockhash")
+        return data["result"] if data["error"] is None else None
+
+    def wait(self):
+        if not self.longpoll:
+            time.sleep(self.interval)
+            return
+
+        data = make_request("waitfornewblock", [int(self.timeout * 1000)])
+
+        if data["error"] is None:
+            return
+
+        if data["error"].get("code") == METHOD_NOT_FOUND:
+            log_message("Node has no waitfornewblock, polling instead")
+            self.longpoll = False
+
+        time.sleep(self.interval)
+
+    @client.pinned()
+    def run(self):
+        while True:
+            # Checked before every wait, a block found while the callback
+            # ran would not wake the next waitfornewblock up
+            tip = self.best()
+
+            if tip is None or tip == self.tip:
+                self.wait()
+                continue
+
+            # The callback returns the hash it synced up to, or raises
+            # when the sync job failed
+            try:
+                self.tip = self.callback()
+
+            except Exception as error:
+                log_message(f"Sync failed: {error!r}")
+                self.tip = None
+
+            if self.tip != tip:
+                time.sleep(self.interval)
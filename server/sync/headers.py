@@ -0,0 +1,68 @@
+from ..utils import make_request, make_batch
+
+
+class HeaderChain(object):
+    """Node block hashes by height for the recent part of the chain
+
+    Filled from the blocks sync already fetches, so checking whether the
+    db tip is still on the node's chain normally costs no RPC at all.
+    """
+
+    def __init__(self, size=1000):
+        self.hashes = {}
+        self.size = size
+
+    def add(self, height, bhash):
+        self.hashes[height] = bhash
+
+        if len(self.hashes) > self.size * 2:
+            top = max(self.hashes)
+            self.hashes = {
+                height: bhash for height, bhash in self.hashes.items()
+                if height > top - self.size
+            }
+
+    def tip(self, height, bhash):
+        # A different hash at a known height means the node reorganized,
+        # anything cached could be from the old branch
+        if self.hashes.get(height) not in [None, bhash]:
+            self.clear()
+
+        self.add(height, bhash)
+
+    def clear(self):
+        self.hashes = {}
+
+    def load(self, heights):
+        missing = [height for height in heights if height not in self.hashes]
+        batch = make_batch([("getblockhash", [height]) for height in missing])
+
+        for height, data in zip(missing, batch):
+            if data["error"] is not None:
+                # An unknown hash is not a mismatch, don't guess a fork
+                raise RuntimeError(f"Failed to get block hash at height {height}")
+
+            self.add(height, data["result"])
+
+    def get(self, height):
+        """Node hash at height, None when the node could not be asked"""
+        if height not in self.hashes:
+            data = make_request("getblockhash", [height])
+
+            if data["error"] is not None:
+                return None
+
+            self.add(height, data["result"])
+
+        return self.hashes[height]
+
+    def fork(self, hashes):
+        """Highest height where the db (height -> hash) agrees with the node"""
+        self.load(list(hashes))
+
+        matching = [
+            height for height, bhash in hashes.items()
+            if self.hashes.get(height) == bhash
+        ]
+
+        return max(matching) if matching else None
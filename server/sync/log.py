@@ -0,0 +1,10 @@
+from datetime import datetime
+
+def log_block(message, block, tx=[]):
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    time = block.created.strftime("%Y-%m-%d %H:%M:%S")
+    print(f"{now} {message}: hash={block.blockhash} height={block.height} tx={len(tx)} date='{time}'")
+
+def log_message(message):
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    print(f"{now} {message}")
@@ -0,0 +1,123 @@
+from ..methods.transaction import Transaction
+from ..utils import make_request, make_batch
+from ..models import MEMPOOL_HEIGHT
+from .log import log_message
+import threading
+import time
+
+
+class MempoolTracker(object):
+    """Keeps the mempool rows in step with the node's mempool
+
+    The txids known to be stored at MEMPOOL_HEIGHT are kept in memory, so
+    a pass only fetches what entered the mempool since the last one and
+    evicts what left it without being confirmed.
+    """
+
+    def __init__(self, writer):
+        self.lock = threading.Lock()
+        self.writer = writer
+        self.known = None
+
+    def load(self):
+        cursor = self.writer.cursor()
+        cursor.execute(
+            "SELECT txid FROM chain_transactions WHERE height = %s",
+            [MEMPOOL_HEIGHT]
+        )
+
+        return set(txid for txid, in cursor.fetchall())
+
+    def fetch(self, txids):
+        transactions = {}
+        batch = make_batch([("getrawtransaction", [txid, True]) for txid in txids])
+
+        for txid, data in zip(txids, batch):
+            # Gone from the mempool since getrawmempool, nothing to do
+            if data["error"] is not None:
+                continue
+
+            data["result"].setdefault("timestamp", int(time.time()))
+            transactions[txid] = Transaction.prepare(data["result"])
+
+        return transactions
+
+    def resolvable(self, transactions):
+        """Drop transactions spending outputs the db doesn't have yet"""
+        found = self.writer.resolve(
+            (vin["txid"], vin["vout"])
+            for tx_data in transactions.values() for vin in tx_data["vin"]
+            if "coinbase" not in vin and vin["txid"] not in transactions
+        )
+
+        pending = dict(transactions)
+        changed = True
+
+        while changed:
+            changed = False
+
+            for txid, tx_data in list(pending.items()):
+                if all(
+                    "coinbase" in vin or vin["txid"] in pending
+                    or (vin["txid"], vin["vout"]) in found
+                    for vin in tx_data["vin"]
+                ):
+                    continue
+
+                del pending[txid]
+                changed = True
+
+        return pending
+
+    def evict(self, txids):
+        tids = [tid for tid, in self.writer.select(
+            "SELECT id FROM chain_transactions "
+            f"WHERE height = {MEMPOOL_HEIGHT} AND txid IN ({{}})", txids
+        )]
+
+        if tids:
+            log_message(f"Evicting {len(tids)} transactions that left the mempool")
+            self.writer.evict(tids)
+
+    def sync(self):
+        """Returns how many transactions were added or evicted"""
+        data = make_request("getrawmempool")
+
+        if data["error"] is not None:
+            return 0
+
+        if self.known is None:
+            self.known = self.load()
+
+        current = set(data["result"])
+        added = list(current - self.known)
+        dropped = list(self.known - current)
+
+        # Confirmed ones are no longer at MEMPOOL_HEIGHT and are left alone
+        if dropped:
+            self.evict(dropped)
+            self.known -= set(dropped)
+
+        transactions = self.add(added)
+
+        if transactions:
+            log_message(f"Added {len(transactions)} mempool transactions")
+
+        return len(dropped) + len(transactions)
+
+    def add(self, txids):
+        """Store the ones the db doesn't have yet, returns those written"""
+        # Stored by the block sync or a wallet broadcast in the meantime
+        existing = self.writer.transaction_ids(txids)
+
+        transactions = self.resolvable(
+            self.fetch([txid for txid in txids if txid not in existing])
+        )
+
+        if transactions:
+            self.writer.write(None, transactions, MEMPOOL_HEIGHT)
+
+        if self.known is not None:
+            self.known |= set(existing) | set(transactions)
+
+        return transactions
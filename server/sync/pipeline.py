@@ -0,0 +1,54 @@
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import time
+
+
+class Prefetcher(object):
+    """Runs fetch over items with a bounded pool of workers, at most depth
+    items ahead of the consumer, and yields (item, result) in input order.
+    """
+
+    def __init__(self, fetch, items, workers=4, depth=32):
+        self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.items = iter(items)
+        self.pending = deque()
+        self.fetch = fetch
+        self.position = None
+        self.depth = depth
+        self.waited = 0
+
+    def fill(self):
+        while len(self.pending) < self.depth:
+            try:
+                item = next(self.items)
+
+            except StopIteration:
+                return
+
+            self.pending.append((item, self.executor.submit(self.fetch, item)))
+            self.position = item
+
+    def __iter__(self):
+        self.fill()
+
+        while self.pending:
+            item, future = self.pending.popleft()
+            started = time.time()
+            result = future.result()
+            self.waited += time.time() - started
+            self.fill()
+
+            yield item, result
+
+    def close(self):
+        for _, future in self.pending:
+            future.cancel()
+
+        self.pending.clear()
+        self.executor.shutdown(wait=False)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
@@ -0,0 +1,124 @@
+from .log import log_message
+import threading
+import traceback
+import time
+
+
+class Job(object):
+    def __init__(self, name, func, priority, interval=None, minimum=None,
+                 maximum=None):
+        self.minimum = minimum or interval
+        self.maximum = maximum or interval
+        self.priority = priority
+        self.interval = interval
+        self.name = name
+        self.func = func
+        self.running = False
+        self.queued = False
+        self.result = None
+        self.error = None
+        self.runs = 0
+        self.due = None
+        self.schedule()
+
+    def schedule(self):
+        self.due = time.time() + self.interval if self.interval else None
+
+    def adapt(self):
+        """Come back sooner after a pass that found work, later after an idle one"""
+        if not self.interval:
+            return
+
+        if self.result:
+            self.interval = max(self.minimum, self.interval / 2)
+
+        else:
+            self.interval = min(self.maximum, self.interval * 1.5)
+
+
+class SyncScheduler(object):
+    """Runs the sync jobs one at a time on a single writer thread
+
+    Jobs are queued by a request or when their interval is up, and the
+    queued job with the lowest priority number runs next. A job that is
+    already queued is not queued twice, its requests coalesce into one
+    run. Jobs return what they found, a falsy result counts as an idle
+    pass. Found work halves the interval down to minimum, an idle pass
+    stretches it up to maximum.
+    """
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.jobs = {}
+
+    def add(self, name, func, priority, interval=None, minimum=None,
+            maximum=None):
+        with self.condition:
+            self.jobs[name] = Job(name, func, priority, interval, minimum, maximum)
+
+    def request(self, name, wait=False):
+        """Queue a job, with wait block until a run that started after the
+        request is done and return its result, or raise what it raised
+        """
+        with self.condition:
+            job = self.jobs[name]
+
+            # A run already under way may have missed what prompted this
+            runs = job.runs + (2 if job.running else 1)
+
+            if not job.queued:
+                job.queued = True
+                self.condition.notify_all()
+
+            while wait and job.runs < runs:
+                self.condition.wait()
+
+            if wait and job.error is not None:
+                raise job.error
+
+            return job.result if wait else None
+
+    def next(self):
+        with self.condition:
+            while True:
+                now = time.time()
+
+                for job in self.jobs.values():
+                    if job.due is not None and job.due <= now and not job.running:
+                        job.queued = True
+
+                queued = [job for job in self.jobs.values() if job.queued]
+
+                if queued:
+                    job = min(queued, key=lambda job: job.priority)
+                    job.queued = False
+                    job.running = True
+                    return job
+
+                due = [job.due for job in self.jobs.values() if job.due is not None]
+                self.condition.wait(max(min(due) - now, 0) if due else None)
+
+    def run(self):
+        while True:
+            job = self.next()
+            result = None
+            error = None
+
+            try:
+                result = job.func()
+
+            except Exception as failure:
+                log_message(f"Sync job {job.name} failed:\n{traceback.format_exc()}")
+                error = failure
+
+            with self.condition:
+                job.result = result
+                job.error = error
+                job.adapt()
+                job.schedule()
+                job.running = False
+                job.runs += 1
+                self.condition.notify_all()
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
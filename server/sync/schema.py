@@ -0,0 +1,176 @@
+from .checkpoint import Checkpoint
+from .log import log_message
+from ..models import db
+from pony import orm
+
+# Keys the bulk writer upserts against. Fresh databases get them from the
+# models, older ones are upgraded in place.
+UNIQUE_KEYS = [
+    ("chain_addresses", "unq_chain_addresses__address", ["address"]),
+    ("chain_tokens", "unq_chain_tokens__name", ["name"]),
+    (
+        "chain_address_balance", "unq_chain_address_balance__address_currency",
+        ["address", "currency"]
+    )
+]
+
+
+# Overlapping jobs of the old scheduler could insert the same address or
+# balance twice, such rows are merged into the oldest one before the key
+# goes on. Every statement joins the duplicate groups as d.
+DUPLICATES = {
+    "chain_addresses": (
+        "SELECT address, MIN(id) AS keep FROM chain_addresses "
+        "GROUP BY address HAVING COUNT(*) > 1",
+        [
+            "UPDATE chain_outputs o JOIN chain_addresses a ON a.id = o.address "
+            "JOIN ({}) d ON d.address = a.address "
+            "SET o.address = d.keep WHERE a.id <> d.keep",
+            "UPDATE chain_address_balance b JOIN chain_addresses a ON a.id = b.address "
+            "JOIN ({}) d ON d.address = a.address "
+            "SET b.address = d.keep WHERE a.id <> d.keep",
+            # Links the kept address already has stay behind and go below
+            "UPDATE IGNORE chain_address_transactions l "
+            "JOIN chain_addresses a ON a.id = l.address "
+            "JOIN ({}) d ON d.address = a.address "
+            "SET l.address = d.keep WHERE a.id <> d.keep",
+            "DELETE l FROM chain_address_transactions l "
+            "JOIN chain_addresses a ON a.id = l.address "
+            "JOIN ({}) d ON d.address = a.address WHERE a.id <> d.keep",
+            "DELETE a FROM chain_addresses a "
+            "JOIN ({}) d ON d.address = a.address WHERE a.id <> d.keep"
+        ]
+    ),
+    "chain_tokens": (
+        # Written from the same node data, the latest row wins
+        "SELECT name, MAX(id) AS keep FROM chain_tokens "
+        "GROUP BY name HAVING COUNT(*) > 1",
+        [
+            "DELETE t FROM chain_tokens t "
+            "JOIN ({}) d ON d.name = t.name WHERE t.id <> d.keep"
+        ]
+    ),
+    "chain_address_balance": (
+        "SELECT address, currency, MIN(id) AS keep, SUM(balance) AS total "
+        "FROM chain_address_balance GROUP BY address, currency HAVING COUNT(*) > 1",
+        [
+            "UPDATE chain_address_balance b JOIN ({}) d ON d.keep = b.id "
+            "SET b.balance = d.total",
+            "DELETE b FROM chain_address_balance b "
+            "JOIN ({}) d ON d.address = b.address AND d.currency = b.currency "
+            "WHERE b.id <> d.keep"
+        ]
+    )
+}
+
+
+def has_index(cursor, table, name):
+    cursor.execute(
+        "SELECT 1 FROM information_schema.statistics "
+        "WHERE table_schema = DATABASE() AND table_name = %s AND index_name = %s",
+        [table, name]
+    )
+
+    return cursor.fetchone() is not None
+
+
+def merge_duplicates(cursor, table):
+    groups, statements = DUPLICATES[table]
+    cursor.execute(f"SELECT COUNT(*) FROM ({groups}) d")
+
+    if not (count := cursor.fetchone()[0]):
+        return
+
+    log_message(f"Merging {count} sets of duplicate rows in {table}")
+
+    for statement in statements:
+        cursor.execute(statement.format(groups))
+
+
+@orm.db_session
+def upgrade():
+    cursor = db.get_connection().cursor()
+
+    for table, name, columns in UNIQUE_KEYS:
+        if has_index(cursor, table, name):
+            continue
+
+        merge_duplicates(cursor, table)
+        log_message(f"Adding unique key {name} to {table}")
+
+        cursor.execute(
+            f"ALTER TABLE {table} ADD UNIQUE KEY {name} ({', '.join(columns)})"
+        )
+
+    # Left dropped while an initial block download is under way
+    if (state := Checkpoint().load()) is None or state["mode"] != "ibd":
+        restore_indexes()
+
+    orm.commit()
+
+
+# Secondary indexes nothing on the write path reads. Initial block
+# download drops them and builds them once at the end, which is a lot
+# cheaper than keeping them up to date row by row. Indexes backing
+# foreign keys or lookups done by the writer stay. The models do not
+# declare these, Pony would recreate them whenever a process maps the
+# models, only restore_indexes builds them.
+DEFERRED_INDEXES = [
+    ("chain_outputs", "idx_chain_outputs__currency", ["currency"]),
+    (
+        "chain_outputs", "idx_chain_outputs__address_currency_spent_by",
+        ["address", "currency", "spent_by"]
+    ),
+    (
+        "chain_transaction_index", "idx_chain_transaction_index__currency",
+        ["currency"]
+    )
+]
+
+
+def backs_foreign_key(cursor, table, name):
+    """Whether MySQL needs the index for a foreign key, having no other
+    index that starts with the same column
+    """
+    cursor.execute(
+        "SELECT 1 FROM information_schema.statistics s "
+        "JOIN information_schema.key_column_usage k "
+        "ON k.table_schema = s.table_schema AND k.table_name = s.table_name "
+        "AND k.column_name = s.column_name AND k.referenced_table_name IS NOT NULL "
+        "WHERE s.table_schema = DATABASE() AND s.table_name = %s "
+        "AND s.index_name = %s AND s.seq_in_index = 1 AND NOT EXISTS ("
+        "SELECT 1 FROM information_schema.statistics o "
+        "WHERE o.table_schema = s.table_schema AND o.table_name = s.table_name "
+        "AND o.column_name = s.column_name AND o.seq_in_index = 1 "
+        "AND o.index_name <> s.index_name)",
+        [table, name]
+    )
+
+    return cursor.fetchone() is not None
+
+
+def defer_indexes():
+    cursor = db.get_connection().cursor()
+
+    for table, name, _ in DEFERRED_INDEXES:
+        if not has_index(cursor, table, name):
+            continue
+
+        # Dropping it would fail with error 1553
+        if backs_foreign_key(cursor, table, name):
+            log_message(f"Keeping index {name} on {table}, a foreign key needs it")
+            continue
+
+        log_message(f"Deferring index {name} on {table}")
+        cursor.execute(f"ALTER TABLE {table} DROP INDEX {name}")
+
+
+def restore_indexes():
+    cursor = db.get_connection().cursor()
+
+    for table, name, columns in DEFERRED_INDEXES:
+        if not has_index(cursor, table, name):
+            log_message(f"Rebuilding index {name} on {table}")
+            cursor.execute(
+                f"ALTER TABLE {table} ADD INDEX {name} ({', '.join(columns)})"
+            )
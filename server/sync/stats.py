@@ -0,0 +1,163 @@
+from collections import deque
+import threading
+import resource
+import time
+
+# Sliding windows for the block and transaction rates, in seconds
+WINDOWS = [60, 300, 900]
+
+
+def memory():
+    """Current and peak resident set size of the process in MB"""
+    peak = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+
+    except OSError:
+        return peak, peak
+
+    return round(pages * resource.getpagesize() / 2 ** 20, 1), peak
+
+
+class SyncStats(object):
+    """Running totals, gauges and rates of what the block sync is doing"""
+
+    COUNTERS = [
+        "blocks", "transactions", "inputs", "outputs", "rows",
+        "reorgs", "reorg_blocks", "fetch_time", "decode_time",
+        "fetch_wait", "write_time", "commit_time"
+    ]
+
+    GAUGES = [
+        "db_height", "node_height", "mempool", "last_commit",
+        "last_reorg_depth", "max_reorg_depth", "rss_mb",
+        "batch_peak_rss_mb", "peak_rss_mb"
+    ]
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+        self.gauges = dict.fromkeys(self.GAUGES)
+        self.events = deque()
+
+    def add(self, **values):
+        with self.lock:
+            for key, value in values.items():
+                self.counters[key] += value
+
+    def set(self, **values):
+        with self.lock:
+            self.gauges.update(values)
+
+    def block(self, transactions):
+        now = time.time()
+
+        with self.lock:
+            self.events.append((now, transactions))
+
+            while self.events[0][0] < now - max(WINDOWS):
+                self.events.popleft()
+
+    def reorg(self, depth):
+        with self.lock:
+            self.counters["reorgs"] += 1
+            self.counters["reorg_blocks"] += depth
+            self.gauges["last_reorg_depth"] = depth
+            self.gauges["max_reorg_depth"] = max(
+                depth, self.gauges["max_reorg_depth"] or 0
+            )
+
+    def rates(self):
+        now = time.time()
+        result = {}
+
+        with self.lock:
+            for window in WINDOWS:
+                recent = [txs for at, txs in self.events if at >= now - window]
+                result[f"{window}s"] = {
+                    "blocks": round(len(recent) / window, 3),
+                    "transactions": round(sum(recent) / window, 3)
+                }
+
+        return result
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters)
+
+    @staticmethod
+    def diff(before, after):
+        return {key: after[key] - before.get(key, 0) for key in after}
+
+    def status(self):
+        with self.lock:
+            gauges = dict(self.gauges)
+
+        lag = None
+        age = None
+
+        if gauges["node_height"] is not None and gauges["db_height"] is not None:
+            lag = gauges["node_height"] - gauges["db_height"]
+
+        if gauges["last_commit"] is not None:
+            age = round(time.time() - gauges["last_commit"], 3)
+
+        return {
+            **gauges,
+            "lag": lag,
+            "last_commit_age": age,
+            "rates": self.rates(),
+            "totals": self.snapshot()
+        }
+
+    def prometheus(self):
+        status = self.status()
+        lines = [
+            "# TYPE plb_sync_db_height gauge",
+            "# TYPE plb_sync_node_height gauge",
+            "# TYPE plb_sync_lag_blocks gauge",
+            "# TYPE plb_sync_mempool_transactions gauge",
+            "# TYPE plb_sync_last_commit_age_seconds gauge",
+            "# TYPE plb_sync_last_reorg_depth gauge",
+            "# TYPE plb_sync_max_reorg_depth gauge",
+            "# TYPE plb_sync_rss_bytes gauge",
+            "# TYPE plb_sync_batch_peak_rss_bytes gauge",
+            "# TYPE plb_sync_peak_rss_bytes gauge",
+            "# TYPE plb_sync_blocks_per_second gauge",
+            "# TYPE plb_sync_transactions_per_second gauge"
+        ]
+
+        for name, key in [
+            ("db_height", "db_height"), ("node_height", "node_height"),
+            ("lag_blocks", "lag"), ("mempool_transactions", "mempool"),
+            ("last_commit_age_seconds", "last_commit_age"),
+            ("last_reorg_depth", "last_reorg_depth"),
+            ("max_reorg_depth", "max_reorg_depth")
+        ]:
+            if status[key] is not None:
+                lines.append(f"plb_sync_{name} {status[key]}")
+
+        for name in ["rss", "batch_peak_rss", "peak_rss"]:
+            if status[f"{name}_mb"] is not None:
+                lines.append(f"plb_sync_{name}_bytes {int(status[f'{name}_mb'] * 2 ** 20)}")
+
+        for window, rates in status["rates"].items():
+            lines.append(f'plb_sync_blocks_per_second{{window="{window}"}} {rates["blocks"]}')
+            lines.append(f'plb_sync_transactions_per_second{{window="{window}"}} {rates["transactions"]}')
+
+        for key, value in status["totals"].items():
+            if key.endswith("_time"):
+                name = f"{key[:-5]}_seconds_total"
+
+            elif key == "fetch_wait":
+                name = "fetch_wait_seconds_total"
+
+            else:
+                name = f"{key}_total"
+
+            lines.append(f"# TYPE plb_sync_{name} counter")
+            lines.append(f"plb_sync_{name} {round(value, 6)}")
+
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,40 @@
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import threading
+import json
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        stats = self.server.stats
+
+        if self.path == "/status":
+            self.reply(json.dumps(stats.status()), "application/json")
+
+        elif self.path == "/metrics":
+            self.reply(stats.prometheus(), "text/plain; version=0.0.4")
+
+        else:
+            self.reply("Not found", "text/plain", 404)
+
+    def reply(self, body, content_type, status=200):
+        body = body.encode()
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(stats, host="127.0.0.1", port=4322):
+    """Expose the sync process's stats on /status and /metrics"""
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    server.stats = stats
+
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    return server
@@ -0,0 +1,77 @@
+from ..utils import make_request, make_batch
+from .log import log_message
+from decimal import Decimal
+
+# Outputs that create a token or change its supply or metadata
+TOKEN_EVENTS = ["new_token", "reissue_token"]
+
+
+def token_category(name):
+    if "#" in name:
+        return "unique"
+    if "/" in name:
+        return "sub"
+    if name[0] == "@":
+        return "username"
+    if name[0] == "!":
+        return "owner"
+    return "root"
+
+
+class TokenRegistry(object):
+    """Keeps chain_tokens up to date from the issuances sync comes across
+
+    Only tokens issued or reissued in synced blocks are refreshed, the
+    full listtokens sweep is left to an occasional reconcile().
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+
+    @staticmethod
+    def row(name, data, height=None, blockhash=None):
+        return (
+            Decimal(str(data["amount"])),
+            data["ipfs_hash"] if data["has_ipfs"] == 1 else None,
+            name, bool(data["reissuable"]), token_category(name),
+            data.get("block_height", height), data["units"],
+            data.get("blockhash", blockhash)
+        )
+
+    def upsert(self, rows):
+        # Issuance height and block never change, the rest can be reissued
+        self.writer.execute(
+            "INSERT INTO chain_tokens (amount, ipfs, name, reissuable, "
+            "category, height, units, block) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE amount = VALUES(amount), "
+            "ipfs = VALUES(ipfs), reissuable = VALUES(reissuable), "
+            "units = VALUES(units)",
+            rows
+        )
+
+    def refresh(self, seen):
+        """seen maps token names to the (height, blockhash) they were seen at"""
+        names = sorted(seen)
+        batch = make_batch([("gettokendata", [name]) for name in names])
+        rows = []
+
+        for name, data in zip(names, batch):
+            if data["error"] is None and data["result"]:
+                rows.append(self.row(name, data["result"], *seen[name]))
+
+        self.upsert(rows)
+
+        if rows:
+            log_message(f"Refreshed {len(rows)} tokens")
+
+    def reconcile(self):
+        log_message("Reconciling tokens list")
+
+        tokens = make_request("listtokens", ["", True])
+
+        if tokens["error"] is None:
+            self.upsert([
+                self.row(name, data)
+                for name, data in tokens["result"].items()
+            ])
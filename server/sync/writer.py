@@ -0,0 +1,537 @@
+from ..models import Transaction, MEMPOOL_HEIGHT, db
+from .tokens import TOKEN_EVENTS
+from .log import log_message
+from .caches import LRU
+from datetime import datetime
+from decimal import Decimal
+from pony import orm
+from .. import utils
+import json
+
+# Values per IN (...) lookup
+CHUNK = 1000
+
+
+def decimal(value):
+    return Decimal(str(value))
+
+
+def chunks(items, size=CHUNK):
+    items = list(items)
+    return (items[i:i + size] for i in range(0, len(items), size))
+
+
+class BlockWriter(object):
+    """Writes a block worth of transactions as multi-row statements
+
+    Rows are built for the whole block first, then inserted table by table
+    with executemany and foreign keys are resolved with one lookup per
+    table instead of one per row. Runs on the connection of the current
+    db_session so everything commits together with the Pony changes.
+    """
+
+    def __init__(self, utxo_cache=500000, address_cache=200000):
+        self.addresses = LRU(address_cache)
+        self.utxos = LRU(utxo_cache)
+        self.inserted = {}
+        self.staged = {}
+        self.tokens = {}
+        self.rows = 0
+
+    def commit(self):
+        # Ids learned while writing a block are only cached once it commits
+        for outpoint, entry in self.staged.items():
+            self.utxos.put(outpoint, entry)
+
+        for address, aid in self.inserted.items():
+            self.addresses.put(address, aid)
+
+        self.inserted = {}
+        self.staged = {}
+
+    def rollback(self):
+        self.inserted = {}
+        self.staged = {}
+
+    def reset(self):
+        self.addresses.clear()
+        self.utxos.clear()
+        self.rollback()
+
+    def resolve(self, outpoints):
+        """Map (txid, n) to (output id, address id, currency, amount)
+
+        Served from the UTXO cache where possible, the misses are looked up
+        with a single query.
+        """
+        result = {}
+        missing = set()
+
+        for outpoint in outpoints:
+            entry = self.staged.get(outpoint) or self.utxos.get(outpoint)
+
+            if entry:
+                result[outpoint] = entry
+
+            else:
+                missing.add(outpoint)
+
+        if missing:
+            result.update(self.prevouts(missing))
+
+        return result
+
+    def spend(self, outpoint):
+        self.staged.pop(outpoint, None)
+        self.utxos.pop(outpoint)
+
+    @staticmethod
+    def cursor():
+        return db.get_connection().cursor()
+
+    def execute(self, sql, rows):
+        if not rows:
+            return
+
+        self.cursor().executemany(sql, rows)
+        self.rows += len(rows)
+
+    def select(self, sql, values):
+        result = []
+
+        for chunk in chunks(values):
+            cursor = self.cursor()
+            cursor.execute(
+                sql.format(", ".join(["%s"] * len(chunk))), chunk
+            )
+            result += cursor.fetchall()
+
+        return result
+
+    def transaction_ids(self, txids):
+        return dict((txid, tid) for tid, txid in self.select(
+            "SELECT id, txid FROM chain_transactions WHERE txid IN ({})", txids
+        ))
+
+    def address_ids(self, addresses):
+        """Map address strings to ids, inserting the ones not seen before"""
+        sql = "SELECT id, address FROM chain_addresses WHERE address IN ({})"
+        result = {}
+        missing = []
+
+        for address in addresses:
+            aid = self.inserted.get(address) or self.addresses.get(address)
+
+            if aid is not None:
+                result[address] = aid
+
+            else:
+                missing.append(address)
+
+        if missing:
+            # Relies on the unique key, addresses that exist are left alone
+            self.execute(
+                "INSERT IGNORE INTO chain_addresses (address) VALUES (%s)",
+                [(address,) for address in missing]
+            )
+
+            for aid, address in self.select(sql, missing):
+                self.inserted[address] = aid
+                result[address] = aid
+
+        return result
+
+    def prevouts(self, outpoints):
+        txids = list(set(txid for txid, _ in outpoints))
+        result = {}
+
+        rows = self.select(
+            "SELECT o.id, t.txid, o.n, o.address, o.currency, o.amount "
+            "FROM chain_outputs o JOIN chain_transactions t ON t.id = o.transaction "
+            "WHERE t.txid IN ({})", txids
+        )
+
+        for oid, txid, n, address, currency, amount in rows:
+            if (txid, n) in outpoints:
+                result[(txid, n)] = (oid, address, currency, amount)
+
+        return result
+
+    def conflicts(self, outputs):
+        return self.select(
+            "SELECT i.vout, i.transaction FROM chain_inputs i WHERE i.vout IN ({})",
+            outputs
+        )
+
+    def remove_conflicts(self, prevouts, spenders):
+        spent = [prevout[0] for prevout in prevouts.values()]
+
+        for _, tid in self.conflicts(spent):
+            transaction = Transaction.get(id=tid)
+
+            if transaction and transaction.txid not in spenders:
+                log_message(f"Deleting conflicting transaction {transaction.txid}")
+
+                for output in transaction.outputs:
+                    self.spend((transaction.txid, output.n))
+
+                self.release([tid])
+                transaction.delete()
+
+        orm.flush()
+
+    def confirm(self, block, txids):
+        existing = self.transaction_ids(txids)
+
+        self.execute(
+            "UPDATE chain_transactions SET height = %s, block = %s WHERE id = %s",
+            [(block.height, block.id, tid) for tid in existing.values()]
+        )
+
+        self.execute(
+            "UPDATE chain_outputs o JOIN chain_inputs i ON i.vout = o.id "
+            "SET o.spent_height = %s WHERE i.transaction = %s",
+            [(block.height, tid) for tid in existing.values()]
+        )
+
+        return existing
+
+    def write(self, block, transactions, height, coinbase=None,
+              coinstake=None, conflicts=True):
+        """Insert transactions (txid -> decoded tx) that are not in the db
+
+        block is the Pony Block entity or None for mempool transactions,
+        conflicts=False skips looking for double spends in the mempool.
+        """
+
+        outpoints = set()
+        addresses = {}
+
+        for tx_data in transactions.values():
+            for vin in tx_data["vin"]:
+                if "coinbase" not in vin:
+                    outpoints.add((vin["txid"], vin["vout"]))
+
+            for vout in self.outputs(tx_data):
+                addresses[vout["scriptPubKey"]["addresses"][0]] = True
+
+        # Outputs created by these transactions are resolved after insert
+        prevouts = self.resolve(
+            outpoint for outpoint in outpoints
+            if outpoint[0] not in transactions
+        )
+
+        # Drop mempool transactions that double spend what this block spends
+        if prevouts and conflicts:
+            self.remove_conflicts(prevouts, transactions)
+
+        self.execute(
+            "INSERT INTO chain_transactions (amount, coinstake, coinbase, txid, "
+            "height, created, locktime, size, block) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            [
+                (
+                    decimal(utils.amount(tx_data["amount"])),
+                    txid == coinstake, txid == coinbase, txid, height,
+                    datetime.fromtimestamp(tx_data["timestamp"]),
+                    tx_data["locktime"], tx_data["size"],
+                    block.id if block else None
+                )
+                for txid, tx_data in transactions.items()
+            ]
+        )
+
+        transaction_ids = self.transaction_ids(list(transactions))
+        address_ids = self.address_ids(list(addresses))
+
+        output_rows = []
+        created = {}
+        links = set()
+        deltas = []
+        indexes = []
+
+        for txid, tx_data in transactions.items():
+            tid = transaction_ids[txid]
+            totals = {}
+
+            for vout in self.outputs(tx_data):
+                amount, amount_raw, currency, timelock = self.value(vout)
+                aid = address_ids[vout["scriptPubKey"]["addresses"][0]]
+
+                output_rows.append((
+                    decimal(amount), currency, timelock, amount_raw, aid,
+                    vout["scriptPubKey"]["type"], vout["scriptPubKey"]["hex"],
+                    txid, vout["n"], tid
+                ))
+
+                created[(txid, vout["n"])] = (aid, currency, decimal(amount))
+
+                if block and vout["scriptPubKey"]["type"] in TOKEN_EVENTS:
+                    self.tokens[currency] = (height, block.blockhash)
+                links.add((aid, tid))
+                deltas.append((aid, currency, decimal(amount)))
+                totals[currency] = totals.get(currency, 0) + decimal(amount)
+
+            for currency, amount in totals.items():
+                indexes.append((
+                    currency, amount, tid,
+                    datetime.fromtimestamp(tx_data["timestamp"])
+                ))
+
+        self.execute(
+            "INSERT INTO chain_outputs (amount, currency, timelock, amount_raw, "
+            "address, category, raw, txid, n, transaction) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)",
+            output_rows
+        )
+
+        txids = dict((tid, txid) for txid, tid in transaction_ids.items())
+
+        for oid, tid, n in self.select(
+            "SELECT id, transaction, n FROM chain_outputs WHERE transaction IN ({})",
+            list(txids)
+        ):
+            outpoint = (txids[tid], n)
+
+            if outpoint in created:
+                prevouts[outpoint] = (oid, *created[outpoint])
+
+                # Mempool outputs can be evicted, only cache confirmed ones
+                if block:
+                    self.staged[outpoint] = prevouts[outpoint]
+
+        input_rows = []
+        spent = []
+
+        for txid, tx_data in transactions.items():
+            tid = transaction_ids[txid]
+
+            for vin in tx_data["vin"]:
+                if "coinbase" in vin:
+                    continue
+
+                oid, aid, currency, amount = prevouts[(vin["txid"], vin["vout"])]
+                self.spend((vin["txid"], vin["vout"]))
+
+                input_rows.append((vin["sequence"], vin["vout"], tid, oid))
+                spent.append(oid)
+                links.add((aid, tid))
+                deltas.append((aid, currency, -amount))
+
+        self.execute(
+            "INSERT INTO chain_inputs (sequence, n, transaction, vout) "
+            "VALUES (%s, %s, %s, %s)",
+            input_rows
+        )
+
+        self.mark_spent(spent, height)
+
+        self.execute(
+            "INSERT IGNORE INTO chain_address_transactions (address, transaction) "
+            "VALUES (%s, %s)",
+            list(links)
+        )
+
+        totals = self.apply_balances(deltas)
+
+        self.execute(
+            "INSERT INTO chain_transaction_index (currency, amount, transaction, created) "
+            "VALUES (%s, %s, %s, %s)",
+            indexes
+        )
+
+        # Everything needed to take the block back out, see undo()
+        return {
+            "created": list(transaction_ids.values()),
+            "spent": spent,
+            "balances": [
+                [aid, currency, str(amount)]
+                for (aid, currency), amount in totals.items()
+            ]
+        }
+
+    def apply_balances(self, deltas):
+        """Fold (address id, currency, amount) deltas into one row per key"""
+        totals = {}
+
+        for aid, currency, amount in deltas:
+            totals[(aid, currency)] = totals.get((aid, currency), 0) + amount
+
+        # Sorted so concurrent writers lock rows in the same order
+        self.execute(
+            "INSERT INTO chain_address_balance (balance, address, currency) "
+            "VALUES (%s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE balance = balance + VALUES(balance)",
+            [
+                (amount, aid, currency)
+                for (aid, currency), amount in sorted(totals.items())
+            ]
+        )
+
+        return totals
+
+    def journal(self, block, record, confirmed):
+        self.execute(
+            "INSERT INTO chain_block_undo (blockhash, height, data) "
+            "VALUES (%s, %s, %s)",
+            [(
+                block.blockhash, block.height,
+                json.dumps(dict(record, confirmed=list(confirmed)))
+            )]
+        )
+
+    def prune(self, height):
+        self.cursor().execute(
+            "DELETE FROM chain_block_undo WHERE height < %s", [height]
+        )
+
+    def chunked(self, sql, values, *params):
+        for chunk in chunks(values):
+            self.cursor().execute(
+                sql.format(", ".join(["%s"] * len(chunk))), [*params, *chunk]
+            )
+
+    def mark_spent(self, oids, height):
+        # Kept on the output so unspent lookups stay on its index
+        self.chunked(
+            "UPDATE chain_outputs o JOIN chain_inputs i ON i.vout = o.id "
+            "SET o.spent_by = i.transaction, o.spent_height = %s WHERE o.id IN ({})",
+            oids, height
+        )
+
+    def release(self, tids):
+        """Mark the outputs spent by the inputs of tids unspent again"""
+        self.chunked(
+            "UPDATE chain_outputs o JOIN chain_inputs i ON i.vout = o.id "
+            "SET o.spent_by = NULL, o.spent_height = NULL WHERE i.transaction IN ({})",
+            tids
+        )
+
+    def derive(self, created):
+        """Build the undo record of transactions from their rows"""
+        spent = [oid for oid, in self.select(
+            "SELECT vout FROM chain_inputs WHERE transaction IN ({})", created
+        )]
+
+        balances = self.select(
+            "SELECT address, currency, SUM(amount) FROM chain_outputs "
+            "WHERE transaction IN ({}) GROUP BY address, currency", created
+        )
+
+        balances += [
+            (aid, currency, -amount) for aid, currency, amount in self.select(
+                "SELECT address, currency, SUM(amount) FROM chain_outputs "
+                "WHERE id IN ({}) GROUP BY address, currency", spent
+            )
+        ]
+
+        return {
+            "created": created,
+            "spent": spent,
+            "balances": balances,
+            "confirmed": []
+        }
+
+    def revert(self, record):
+        """Delete the transactions of an undo record and their effects
+
+        Transactions it confirmed out of the mempool go back to it.
+        """
+        created = record["created"]
+        removed = set(created)
+
+        # Mempool transactions spending the removed outputs are invalid now
+        spenders = self.select(
+            "SELECT DISTINCT i.transaction FROM chain_inputs i "
+            "JOIN chain_outputs o ON o.id = i.vout WHERE o.transaction IN ({})",
+            created
+        )
+
+        for tid, in spenders:
+            if tid not in removed and (transaction := Transaction.get(id=tid)):
+                log_message(f"Deleting transaction {transaction.txid} spending removed outputs")
+                self.release([tid])
+                transaction.delete()
+
+        orm.flush()
+
+        self.apply_balances([
+            (aid, currency, -Decimal(str(amount)))
+            for aid, currency, amount in record["balances"]
+        ])
+
+        self.release(created)
+        self.chunked("DELETE FROM chain_inputs WHERE vout IN ({})", record["spent"])
+
+        for table in ["chain_transaction_index", "chain_address_transactions", "chain_outputs"]:
+            self.chunked(f"DELETE FROM {table} WHERE transaction IN ({{}})", created)
+
+        self.chunked("DELETE FROM chain_transactions WHERE id IN ({})", created)
+
+        self.execute(
+            "UPDATE chain_transactions SET height = %s, block = NULL WHERE id = %s",
+            [(MEMPOOL_HEIGHT, tid) for tid in record["confirmed"]]
+        )
+
+        self.chunked(
+            "UPDATE chain_outputs o JOIN chain_inputs i ON i.vout = o.id "
+            "SET o.spent_height = %s WHERE i.transaction IN ({})",
+            record["confirmed"], MEMPOOL_HEIGHT
+        )
+
+    def undo(self, block):
+        """Take a block back out, the Block row itself is left to the caller"""
+        cursor = self.cursor()
+        cursor.execute(
+            "SELECT data FROM chain_block_undo WHERE blockhash = %s",
+            [block.blockhash]
+        )
+
+        if (row := cursor.fetchone()):
+            record = json.loads(row[0])
+
+        else:
+            log_message(f"No undo record for block {block.height}, deriving it")
+            cursor.execute(
+                "SELECT id FROM chain_transactions WHERE block = %s", [block.id]
+            )
+
+            record = self.derive([tid for tid, in cursor.fetchall()])
+
+        self.revert(record)
+
+        cursor.execute(
+            "DELETE FROM chain_block_undo WHERE blockhash = %s",
+            [block.blockhash]
+        )
+
+        self.reset()
+
+    def evict(self, tids):
+        self.revert(self.derive(tids))
+
+    @staticmethod
+    def outputs(tx_data):
+        for vout in tx_data["vout"]:
+            if vout["scriptPubKey"]["type"] in ["nonstandard", "nulldata"]:
+                continue
+
+            yield vout
+
+    @staticmethod
+    def value(vout):
+        amount = utils.amount(vout["valueSat"])
+        amount_raw = vout["valueSat"]
+        currency = "PLB"
+        timelock = 0
+
+        if "token" in vout["scriptPubKey"]:
+            timelock = vout["scriptPubKey"]["token"]["timelock"]
+            currency = vout["scriptPubKey"]["token"]["name"]
+            amount = vout["scriptPubKey"]["token"]["amount"]
+            amount_raw = vout["scriptPubKey"]["token"]["satoshis"]
+
+        if "timelock" in vout["scriptPubKey"]:
+            timelock = vout["scriptPubKey"]["timelock"]
+
+        return amount, amount_raw, currency, timelock
@@ -1,7 +1,6 @@
-import requests
+from .node import client
 import config
 import math
-import json
 
 
 def get_logo(name):
@@ -41,15 +40,19 @@ def response(result, error=None, rid=config.rid, pagination=None):
 
 
 def make_request(method, params=[]):
-    headers = {"content-type": "text/plain;"}
-    data = json.dumps({"id": config.rid, "method": method, "params": params})
-
     try:
-        return requests.post(config.endpoint, headers=headers, data=data).json()
+        return client.request(method, params)
     except Exception:
         return dead_response()
 
 
+def make_batch(calls):
+    try:
+        return client.batch(calls)
+    except Exception:
+        return [dead_response() for _ in calls]
+
+
 def reward(height):
     halvings = height // 525960
 
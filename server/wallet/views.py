@@ -240,7 +240,7 @@ def get_unspent(args, raw_address):
 
     if (address := AddressService.get_by_address(raw_address)):
         outputs = Output.select(
-            lambda o: o.address == address and o.currency == args["token"] and not o.spent
+            lambda o: o.address == address and o.currency == args["token"] and o.spent_by is None
         )
 
         for output in outputs:
@@ -1,9 +1,13 @@
-from apscheduler.schedulers.blocking import BlockingScheduler
-from server.sync import sync_blocks, sync_tokens
-from server.sync import sync_mempool
+from server.sync import follow_tip, stats, SYNC
+from server.sync import schema, status
 
-background = BlockingScheduler()
-background.add_job(sync_mempool, "interval", seconds=30)
-background.add_job(sync_tokens, "interval", seconds=30)
-background.add_job(sync_blocks, "interval", seconds=5)
-background.start()
+schema.upgrade()
+
+if SYNC["status"]:
+    status.serve(stats, *SYNC["status"])
+
+# Blocks are followed as the node announces them and written by the same
+# thread as the mempool and token jobs, see SyncScheduler. The mempool is
+# polled between blocks, sooner while it keeps changing. Tokens are
+# refreshed as blocks issue them, the full sweep only reconciles.
+follow_tip()